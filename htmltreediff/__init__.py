@@ -24,6 +24,8 @@ Text Diff Usage
 The<ins> very</ins> quick brown <del>fox jumps</del><ins>foxes jump</ins> over the<del> lazy</del> dog.
 """
 
+__version__ = '0.1.2'
+
 from htmltreediff.html import diff
 from htmltreediff.util import html_equal
 
@@ -0,0 +1,198 @@
+"""
+Generate worst case documents, and measure how the cost of diffing them
+grows with their size.
+
+These are the shapes of input that have caused trouble in practice:
+    * many siblings with the same tag,
+    * very deep nesting,
+    * very large text nodes,
+    * many near duplicate paragraphs, which all collide in the fuzzy
+      matching of FuzzyHashableTree.
+
+Each shape can be made at any size, with or without an edit:
+
+>>> old_html, new_html, options = make_case('deep nesting', 3, edit=True)
+>>> old_html
+'<div><div><div>deep text 3</div></div></div>'
+>>> new_html
+'<div><div><div>deep text three</div></div></div>'
+
+The cost of an algorithm grows like size ** exponent, and the exponent can be
+estimated by fitting a line to the log of the cost against the log of the
+size:
+
+>>> round(growth_exponent([10, 20, 40], [3, 12, 48]), 6)
+2.0
+
+Note that the lxml html parser truncates documents nested more than 256
+levels deep. Use deep_dom() to make deeper documents.
+"""
+
+import math
+import time
+
+from htmltreediff.html import diff
+from htmltreediff.stats import DiffStats
+
+_words = 'lorem ipsum dolor sit amet consectetur adipiscing elit'.split()
+
+def words(count, offset=0):
+    """Return text of count distinct words."""
+    return ' '.join('%s%d' % (_words[i % len(_words)], i // len(_words))
+                    for i in range(offset, offset + count))
+
+def wide_siblings(count, tag='p'):
+    """Return a document of count sibling elements with the same tag."""
+    return ''.join('<%s>item %d</%s>' % (tag, i, tag) for i in range(count))
+
+def deep_nesting(depth, tag='div', text='deep text'):
+    """Return a document of elements nested depth levels deep."""
+    return '<%s>' % tag * depth + text + '</%s>' % tag * depth
+
+def deep_dom(depth, tag='div', text='deep text'):
+    """
+    Return a minidom document of elements nested depth levels deep. Unlike
+    deep_nesting(), this isn't limited by the depth the parser allows.
+    """
+    from xml.dom import minidom
+    dom = minidom.Document()
+    # Build from the bottom up, because minidom looks through all the
+    # ancestors of a node that is in the document when appending to it.
+    node = dom.createTextNode(text)
+    for _ in range(depth):
+        parent = dom.createElement(tag)
+        parent.appendChild(node)
+        node = parent
+    body = dom.createElement('body')
+    body.appendChild(node)
+    dom.appendChild(body)
+    return dom
+
+def large_text(count):
+    """Return a document with a single text node of count words."""
+    return '<p>%s</p>' % words(count)
+
+def near_duplicate_paragraphs(count):
+    """
+    Return a document of count paragraphs, which differ from each other by
+    one word.
+    """
+    return ''.join(
+        '<p>This paragraph is almost the same as the others, number %d.</p>' % i
+        for i in range(count))
+
+def _edit_wide_siblings(size):
+    old_html = wide_siblings(size)
+    return old_html, old_html.replace('item %d<' % (size // 2), 'item changed<')
+
+def _edit_deep_nesting(size):
+    old_html = deep_nesting(size, text='deep text %d' % size)
+    return old_html, old_html.replace('text %d' % size, 'text three')
+
+def _edit_large_text(size):
+    old_html = large_text(size)
+    middle = words(1, size // 2)
+    return old_html, old_html.replace(middle + ' ', 'changed ', 1)
+
+def _edit_near_duplicate_paragraphs(size):
+    old_html = near_duplicate_paragraphs(size)
+    return old_html, old_html.replace('almost', 'nearly')
+
+# Each shape has a function to make an edited pair of documents of a given
+# size, and the diff options to use.
+shapes = {
+    'wide siblings': (_edit_wide_siblings, {}),
+    'deep nesting': (_edit_deep_nesting, {}),
+    'large text': (_edit_large_text, {}),
+    'large plaintext': (_edit_large_text, {'plaintext': True}),
+    'near duplicate paragraphs': (_edit_near_duplicate_paragraphs, {}),
+}
+
+def make_case(shape, size, edit=True):
+    """
+    Return (old_html, new_html, diff_options) for the shape at the given
+    size. If edit is False, the documents are identical.
+    """
+    make_pair, options = shapes[shape]
+    old_html, new_html = make_pair(size)
+    if not edit:
+        new_html = old_html
+    return old_html, new_html, dict(options)
+
+def growth_exponent(sizes, costs):
+    """
+    Fit cost = c * size ** exponent by least squares on a log-log scale, and
+    return the exponent.
+    """
+    xs = [math.log(size) for size in sizes]
+    ys = [math.log(max(cost, 1e-9)) for cost in costs]
+    mean_x = sum(xs) / len(xs)
+    mean_y = sum(ys) / len(ys)
+    covariance = sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys))
+    variance = sum((x - mean_x) ** 2 for x in xs)
+    return covariance / variance
+
+def diff_cost(old_html, new_html, options, counter=None, repeat=3):
+    """
+    Return the cost of the diff, either as the best wall clock time of a few
+    repeats, or as the value of a DiffStats counter.
+    """
+    if counter is not None:
+        stats = DiffStats()
+        diff(old_html, new_html, stats=stats, **options)
+        return stats.counters.get(counter, 0)
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        diff(old_html, new_html, **options)
+        seconds = time.time() - start
+        if best is None or seconds < best:
+            best = seconds
+    return best
+
+def measure_growth(shape, sizes, edit=True, counter=None, repeat=3):
+    """
+    Diff the shape at each size, and return (exponent, costs), where the
+    exponent is the growth exponent of the cost against the size.
+    """
+    costs = []
+    for size in sizes:
+        old_html, new_html, options = make_case(shape, size, edit)
+        costs.append(diff_cost(old_html, new_html, options, counter, repeat))
+    return growth_exponent(sizes, costs), costs
+
+def measure_deep_growth(depths, edit=True, counter='tree_hashes'):
+    """
+    Like measure_growth(), for documents nested each of the depths deep,
+    made with deep_dom(), so that they can be deeper than the parser allows.
+    Only the tree diff is run, and the cost is the value of a DiffStats
+    counter.
+    """
+    from htmltreediff.diff_core import Differ
+    costs = []
+    for depth in depths:
+        old_dom = deep_dom(depth, text='deep text %d' % depth)
+        new_dom = deep_dom(depth, text='deep text %d' % depth)
+        if edit:
+            new_dom = deep_dom(depth, text='deep text three')
+        stats = DiffStats()
+        with stats.activate():
+            Differ(old_dom, new_dom).get_edit_script()
+        costs.append(stats.counters.get(counter, 0))
+    return growth_exponent(depths, costs), costs
+
+def main():
+    sizes = [25, 50, 100]
+    for shape in sorted(shapes):
+        for edit in [False, True]:
+            exponent, costs = measure_growth(shape, sizes, edit)
+            print '%-28s %-9s exponent %4.2f  (%s)' % (
+                shape,
+                edit and 'edited' or 'identical',
+                exponent,
+                ', '.join('%d: %.1f ms' % (size, cost * 1000)
+                          for size, cost in zip(sizes, costs)),
+            )
+
+if __name__ == '__main__':
+    main() # pragma: no cover
@@ -0,0 +1,208 @@
+"""
+Diff many pairs of files at once, in parallel.
+
+The pairs come either from a manifest file, or from two directory trees with
+the files matched up by relative path. The manifest is a CSV file with old
+and new paths in the first two columns, or a JSON lines file with "old" and
+"new" keys. Both formats may also give a "name" for each pair, used to name
+the output.
+"""
+
+import os
+import sys
+import csv
+import json
+import time
+import hashlib
+import argparse
+
+from htmltreediff.html import diff
+from htmltreediff.parallel import DiffPool
+
+def read_manifest(path):
+    """Read the manifest file, yielding (name, old_path, new_path) tuples."""
+    # Relative paths in the manifest are relative to the manifest itself.
+    base_dir = os.path.dirname(os.path.abspath(path))
+    with open(path) as manifest:
+        if path.endswith('.jsonl') or path.endswith('.json'):
+            rows = _read_jsonl_rows(manifest)
+        else:
+            rows = _read_csv_rows(manifest)
+        for name, old_path, new_path in rows:
+            old_path = os.path.join(base_dir, old_path)
+            new_path = os.path.join(base_dir, new_path)
+            yield name, old_path, new_path
+
+def _read_jsonl_rows(manifest):
+    for line in manifest:
+        if not line.strip():
+            continue
+        row = json.loads(line)
+        yield row.get('name') or row['new'], row['old'], row['new']
+
+def _read_csv_rows(manifest):
+    for row in csv.reader(manifest):
+        if not row or row[0].startswith('#'):
+            continue
+        if row[:2] == ['old', 'new']: # header
+            continue
+        if len(row) >= 3:
+            name = row[2]
+        else:
+            name = row[1]
+        yield name, row[0], row[1]
+
+def match_trees(old_dir, new_dir):
+    """
+    Yield (name, old_path, new_path) for each file that is in both directory
+    trees, in sorted order. The name is the relative path.
+    """
+    for name in sorted(_relative_paths(old_dir) & _relative_paths(new_dir)):
+        yield name, os.path.join(old_dir, name), os.path.join(new_dir, name)
+
+def _relative_paths(root):
+    paths = set()
+    for dir_path, dir_names, file_names in os.walk(root):
+        for file_name in file_names:
+            path = os.path.join(dir_path, file_name)
+            paths.add(os.path.relpath(path, root))
+    return paths
+
+def file_digest(path):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(64 * 1024), ''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def diff_files(name, old_path, new_path, skip_unchanged=False, cancel=None,
+               **diff_kwargs):
+    """
+    Diff two files, and return a result dictionary, with keys:
+        {name, old, new, status, seconds, diff}
+    The status is one of 'changed', 'unchanged' or 'error'.
+    """
+    result = {
+        'name': name,
+        'old': old_path,
+        'new': new_path,
+        'diff': None,
+    }
+    start = time.time()
+    try:
+        if skip_unchanged and file_digest(old_path) == file_digest(new_path):
+            result['status'] = 'unchanged'
+        else:
+            with open(old_path) as old_file:
+                old_html = old_file.read()
+            with open(new_path) as new_file:
+                new_html = new_file.read()
+            result['diff'] = diff(old_html, new_html, cancel=cancel, **diff_kwargs)
+            result['status'] = 'changed'
+    except Exception, e:
+        result['status'] = 'error'
+        result['error'] = '%s: %s' % (e.__class__.__name__, e)
+    result['seconds'] = time.time() - start
+    return result
+
+def run_batch(pairs, processes=None, skip_unchanged=False, **diff_kwargs):
+    """Diff each (name, old_path, new_path), yielding results in order."""
+    with DiffPool(processes) as pool:
+        for result in pool.imap(diff_files, pairs,
+                                skip_unchanged=skip_unchanged, **diff_kwargs):
+            yield result
+
+def output_file_path(output_dir, name):
+    """
+    Return the path in output_dir to write the diff named name to. Raise
+    ValueError if the name leads outside of output_dir, like '../name' does.
+    """
+    output_dir = os.path.realpath(output_dir)
+    path = os.path.realpath(os.path.join(output_dir, name.lstrip(os.sep)))
+    if not path.startswith(output_dir + os.sep):
+        raise ValueError('The output path for %s is outside of %s' % (name, output_dir))
+    return path
+
+def write_output_file(output_dir, result):
+    path = output_file_path(output_dir, result['name'])
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    with open(path, 'w') as f:
+        f.write(_encode(result['diff']))
+        f.write('\n')
+
+def _encode(text):
+    if isinstance(text, unicode):
+        return text.encode('utf-8')
+    return text
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+        prog='htmltreediff batch',
+        description='Diff many pairs of html files in parallel.',
+    )
+    parser.add_argument('--manifest', help='CSV or JSON lines file of old and new paths')
+    parser.add_argument('old_dir', nargs='?', help='directory of old files')
+    parser.add_argument('new_dir', nargs='?', help='directory of new files')
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help='number of worker processes (default: one per cpu)')
+    parser.add_argument('--output-dir', help='write each diff to a file in this directory')
+    parser.add_argument('--jsonl', help='write results as JSON lines to this file, or - for stdout')
+    parser.add_argument('--skip-unchanged', action='store_true',
+                        help='skip pairs of files with identical contents')
+    parser.add_argument('--cutoff', type=float, default=0.0)
+    parser.add_argument('--no-pretty', dest='pretty', action='store_false')
+    args = parser.parse_args(argv)
+
+    if args.manifest:
+        if args.old_dir or args.new_dir:
+            parser.error('give either --manifest or two directories, not both')
+        pairs = read_manifest(args.manifest)
+    elif args.old_dir and args.new_dir:
+        pairs = match_trees(args.old_dir, args.new_dir)
+    else:
+        parser.error('give either --manifest or two directories')
+    if not args.output_dir and not args.jsonl:
+        parser.error('give --output-dir or --jsonl')
+
+    jsonl_file = None
+    if args.jsonl == '-':
+        jsonl_file = sys.stdout
+    elif args.jsonl:
+        jsonl_file = open(args.jsonl, 'w')
+
+    counts = {}
+    total_start = time.time()
+    try:
+        results = run_batch(
+            pairs,
+            processes=args.jobs,
+            skip_unchanged=args.skip_unchanged,
+            cutoff=args.cutoff,
+            pretty=args.pretty,
+        )
+        for result in results:
+            if args.output_dir and result['status'] == 'changed':
+                try:
+                    write_output_file(args.output_dir, result)
+                except ValueError, e:
+                    result['status'] = 'error'
+                    result['error'] = '%s: %s' % (e.__class__.__name__, e)
+            status = result['status']
+            counts[status] = counts.get(status, 0) + 1
+            if jsonl_file:
+                jsonl_file.write(json.dumps(result) + '\n')
+            sys.stderr.write('%8.3fs  %-9s  %s\n' % (result['seconds'], status, result['name']))
+            if status == 'error':
+                sys.stderr.write('    %s\n' % result['error'])
+    finally:
+        if jsonl_file and jsonl_file is not sys.stdout:
+            jsonl_file.close()
+
+    sys.stderr.write('%.3fs total, %s\n' % (
+        time.time() - total_start,
+        ', '.join('%d %s' % (counts[s], s) for s in sorted(counts)),
+    ))
+    if counts.get('error'):
+        return 1
+    return 0
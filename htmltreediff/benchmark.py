@@ -0,0 +1,229 @@
+"""
+Benchmarks for htmltreediff.
+
+Run them from the command line:
+    $ python -m htmltreediff.benchmark
+
+The benchmark corpus also serves as a performance regression gate. The work
+counters from DiffStats are recorded for each corpus entry in a baseline
+file, and the tests fail if a change makes any entry do much more work.
+Unlike timings, the counters don't depend on the machine, so the gate is
+reliable. After a change that is meant to alter the counts, record a new
+baseline:
+    $ python -m htmltreediff.benchmark --record-baseline
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+
+from htmltreediff.html import diff
+from htmltreediff.stats import DiffStats
+
+# Run child interpreters from the directory containing the package, so they
+# import the same copy of it.
+_root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def _run_python(code):
+    return subprocess.check_output([sys.executable, '-c', code], cwd=_root_dir)
+
+def import_time(statement='import htmltreediff', repeat=5):
+    """
+    Return the best time in seconds to run the import statement in a fresh
+    interpreter.
+    """
+    code = (
+        'import time\n'
+        'start = time.time()\n'
+        '%s\n'
+        'print time.time() - start\n'
+    ) % statement
+    return min(float(_run_python(code)) for _ in range(repeat))
+
+def imported_modules(statement='import htmltreediff'):
+    """
+    Return the set of modules that are newly loaded by running the import
+    statement in a fresh interpreter.
+    """
+    code = (
+        'import sys, json\n'
+        'before = set(sys.modules)\n'
+        '%s\n'
+        'print json.dumps(sorted(set(sys.modules) - before))\n'
+    ) % statement
+    return set(json.loads(_run_python(code)))
+
+_import_benchmarks = [
+    ('interpreter startup', 'pass'),
+    ('import htmltreediff', 'import htmltreediff'),
+    ('html_equal, identical documents', (
+        'from htmltreediff import html_equal; '
+        'html_equal("<p>one</p>", "<p>one</p>")')),
+    ('first diff', (
+        'from htmltreediff import diff; '
+        'diff("<p>one</p>", "<p>two</p>")')),
+]
+
+def benchmark_imports():
+    for name, statement in _import_benchmarks:
+        print '%-40s %8.1f ms' % (name, import_time(statement) * 1000)
+
+## Corpus ##
+
+def _paragraphs(count, template='<p>Paragraph %d has a few words in it.</p>'):
+    return ''.join(template % i for i in range(count))
+
+def _list(count):
+    return '<ul>%s</ul>' % ''.join('<li>item %d</li>' % i for i in range(count))
+
+def _table(count):
+    return '<table><tbody>%s</tbody></table>' % ''.join(
+        '<tr><td>row %d</td><td>%d</td></tr>' % (i, i * i) for i in range(count))
+
+def _nested(depth, text):
+    return '<div>' * depth + text + '</div>' * depth
+
+_words = 'the quick brown fox jumps over the lazy dog'.split()
+def _text(count):
+    return ' '.join(_words[i % len(_words)] + str(i // len(_words)) for i in range(count))
+
+def corpus():
+    """
+    Return the benchmark corpus, a list of tuples (name, old_html, new_html,
+    diff_options). It is always the same, so that counts can be compared.
+    """
+    paragraphs = _paragraphs(100)
+    text = _text(50)
+    return [
+        ('identical paragraphs', paragraphs, paragraphs, {}),
+        ('edited paragraphs', paragraphs, paragraphs.replace('1 has', '1 had'), {}),
+        ('inserted paragraphs', paragraphs,
+         paragraphs.replace('</p><p>Paragraph 50 ', '</p><p>New text.</p><p>Paragraph 50 '), {}),
+        ('rewritten paragraphs', paragraphs,
+         _paragraphs(100, '<p>Paragraph %d has different words now.</p>'), {}),
+        ('list edits', _list(100), _list(100).replace('item 1', 'item one'), {}),
+        ('table rows inserted', _table(50), _table(75), {}),
+        ('deep nesting', _nested(50, 'one two three'), _nested(50, 'one four three'), {}),
+        ('text edits', text, text.replace('fox1', 'cat1').replace('dog3', ''),
+         {'plaintext': True}),
+    ]
+
+def measure(old_html, new_html, options, repeat=1):
+    """
+    Diff the documents, and return a dictionary with the work counters of the
+    diff, and the best wall clock time.
+    """
+    best = None
+    for _ in range(repeat):
+        stats = DiffStats()
+        start = time.time()
+        diff(old_html, new_html, stats=stats, **options)
+        seconds = time.time() - start
+        if best is None or seconds < best:
+            best = seconds
+    return {'counters': stats.counters, 'seconds': best}
+
+## Regression gate ##
+
+default_baseline_path = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                     'benchmark_baseline.json')
+
+def record_baseline(path=default_baseline_path, repeat=3):
+    baseline = {}
+    for name, old_html, new_html, options in corpus():
+        baseline[name] = measure(old_html, new_html, options, repeat=repeat)
+    with open(path, 'w') as f:
+        json.dump(baseline, f, indent=4, sort_keys=True)
+        f.write('\n')
+    return baseline
+
+def check_baseline(path=default_baseline_path, threshold=0.1,
+                   timing_threshold=None, repeat=3):
+    """
+    Compare the corpus against the baseline. Return a list of regressions,
+    as tuples (corpus_name, measurement, baseline_value, new_value).
+
+    A counter regresses when it grows by more than the threshold, as a
+    fraction of the baseline value. Timings are only compared if a
+    timing_threshold is given, since they depend on the machine.
+    """
+    with open(path) as f:
+        baseline = json.load(f)
+    regressions = []
+    for name, old_html, new_html, options in corpus():
+        if name not in baseline:
+            continue
+        expected = baseline[name]
+        actual = measure(old_html, new_html, options, repeat=repeat)
+        for counter, expected_count in sorted(expected['counters'].items()):
+            actual_count = actual['counters'].get(counter, 0)
+            if actual_count > expected_count * (1 + threshold):
+                regressions.append((name, counter, expected_count, actual_count))
+        if timing_threshold is not None:
+            if actual['seconds'] > expected['seconds'] * (1 + timing_threshold):
+                regressions.append((name, 'seconds', expected['seconds'], actual['seconds']))
+    return regressions
+
+def benchmark_corpus(repeat):
+    for name, old_html, new_html, options in corpus():
+        result = measure(old_html, new_html, options, repeat=repeat)
+        print '%-40s %8.1f ms' % (name, result['seconds'] * 1000)
+
+def benchmark_walks(depths=(100, 1000, 10000), repeat=3):
+    """Time walking deeply nested documents, lazily and as a snapshot."""
+    from htmltreediff.adversarial import deep_dom
+    from htmltreediff.util import walk_dom
+    for depth in depths:
+        dom = deep_dom(depth)
+        for label, walk in [
+            ('walk_dom', lambda: list(walk_dom(dom))),
+            ('walk_dom snapshot', lambda: walk_dom(dom, snapshot=True)),
+        ]:
+            best = None
+            for _ in range(repeat):
+                start = time.time()
+                walk()
+                seconds = time.time() - start
+                if best is None or seconds < best:
+                    best = seconds
+            print '%-40s %8.1f ms' % ('%s, depth %d' % (label, depth), best * 1000)
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:] # pragma: no cover
+    parser = argparse.ArgumentParser(prog='python -m htmltreediff.benchmark')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--baseline', default=default_baseline_path)
+    parser.add_argument('--record-baseline', action='store_true',
+                        help='record the counters and timings of the corpus as the new baseline')
+    parser.add_argument('--check-baseline', action='store_true',
+                        help='compare the corpus against the baseline')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='allowed growth of counters, as a fraction')
+    parser.add_argument('--timing-threshold', type=float, default=None,
+                        help='allowed growth of timings, as a fraction (default: not checked)')
+    args = parser.parse_args(argv)
+
+    if args.record_baseline:
+        record_baseline(args.baseline, repeat=args.repeat)
+        print 'Recorded baseline in %s' % args.baseline
+        return 0
+    if args.check_baseline:
+        regressions = check_baseline(args.baseline, args.threshold,
+                                     args.timing_threshold, repeat=args.repeat)
+        for name, measurement, expected, actual in regressions:
+            print '%s: %s went from %s to %s' % (name, measurement, expected, actual)
+        if regressions:
+            return 1
+        print 'No regressions.'
+        return 0
+    benchmark_imports()
+    benchmark_corpus(args.repeat)
+    benchmark_walks(repeat=args.repeat)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main()) # pragma: no cover
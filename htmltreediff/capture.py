@@ -0,0 +1,187 @@
+"""
+Capture the inputs of slow diffs, so that they can be replayed and profiled
+later, with `htmltreediff replay`.
+
+Slow documents are hard to reproduce, because they are usually somebody
+else's. Once capturing is enabled, each diff that takes longer than the
+threshold is saved to a JSON file in the capture directory, along with the
+diff options, the library version, and the statistics of the diff:
+
+    from htmltreediff.capture import enable_capture
+    enable_capture('/var/tmp/slow-diffs', threshold=2.0)
+
+To keep a busy process from filling the disk, captures are rate limited, and
+stop when the directory reaches a size cap. The limits are shared by all the
+processes capturing to the same directory, like the workers of a server,
+through a lock file in the directory.
+"""
+
+import os
+import json
+import fcntl
+import time
+import base64
+import hashlib
+import threading
+
+_default_capture = None
+
+def enable_capture(directory, **kwargs):
+    """
+    Capture slow diffs in the directory, for all diffs in this process. The
+    keyword arguments are passed on to SlowDiffCapture.
+    """
+    global _default_capture
+    _default_capture = SlowDiffCapture(directory, **kwargs)
+    return _default_capture
+
+def disable_capture():
+    global _default_capture
+    _default_capture = None
+
+def default_capture():
+    return _default_capture
+
+class SlowDiffCapture(object):
+    """
+    Save the inputs of diffs that take longer than threshold seconds.
+
+    At most one diff is saved to the directory every min_interval seconds.
+    Diffs with more than max_case_bytes of input are not saved, and nothing
+    more is saved once the files in the directory add up to max_total_bytes.
+    """
+    def __init__(self, directory, threshold=1.0, min_interval=60.0,
+                 max_case_bytes=10 * 1024 * 1024,
+                 max_total_bytes=100 * 1024 * 1024):
+        self.directory = directory
+        self.threshold = threshold
+        self.min_interval = min_interval
+        self.max_case_bytes = max_case_bytes
+        self.max_total_bytes = max_total_bytes
+        self._lock = threading.Lock()
+        self._lock_path = os.path.join(directory, '.capture-lock')
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    @property
+    def total_bytes(self):
+        """The size of the capture files in the directory."""
+        total = 0
+        for name in os.listdir(self.directory):
+            if name.endswith('.json'):
+                try:
+                    total += os.path.getsize(os.path.join(self.directory, name))
+                except OSError:
+                    # Removed since it was listed.
+                    pass
+        return total
+
+    def diff_finished(self, old_html, new_html, options, seconds, stats):
+        """
+        Called after each diff. If the diff was slow, save it, and return the
+        path of the capture file. Otherwise return None.
+        """
+        if seconds < self.threshold:
+            return None
+        if len(old_html) + len(new_html) > self.max_case_bytes:
+            return None
+        # The thread lock is needed too, since flock() doesn't exclude other
+        # threads of the same process that open the file separately.
+        with self._lock:
+            try:
+                with open(self._lock_path, 'a+') as lock_file:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)
+                    return self._capture(lock_file, old_html, new_html,
+                                         options, seconds, stats)
+            except (IOError, OSError, ValueError):
+                # Capturing must never break the diff itself.
+                return None
+
+    def _capture(self, lock_file, old_html, new_html, options, seconds, stats):
+        # The lock file holds the time of the last capture to the directory.
+        lock_file.seek(0)
+        last_capture = lock_file.read().strip()
+        now = time.time()
+        if last_capture and now - float(last_capture) < self.min_interval:
+            return None
+        total_bytes = self.total_bytes
+        if total_bytes >= self.max_total_bytes:
+            return None
+        lock_file.seek(0)
+        lock_file.truncate()
+        lock_file.write(repr(now))
+        lock_file.flush()
+        return self._write(old_html, new_html, options, seconds, stats,
+                           total_bytes)
+
+    def _write(self, old_html, new_html, options, seconds, stats, total_bytes):
+        from htmltreediff import __version__
+        case = {
+            'version': __version__,
+            'captured_at': time.time(),
+            'seconds': seconds,
+            'options': encode_options(options),
+            'stats': stats.as_dict(),
+            'old': encode_html(old_html),
+            'new': encode_html(new_html),
+        }
+        data = json.dumps(case, indent=1, sort_keys=True)
+        if total_bytes + len(data) > self.max_total_bytes:
+            return None
+        digest = hashlib.sha1(data).hexdigest()[:12]
+        name = '%s-%s.json' % (time.strftime('%Y%m%d-%H%M%S'), digest)
+        path = os.path.join(self.directory, name)
+        # Write to a temporary file first, so that a replay never reads a
+        # half written capture.
+        temp_path = path + '.tmp'
+        with open(temp_path, 'w') as f:
+            f.write(data)
+        os.rename(temp_path, path)
+        return path
+
+def encode_options(options):
+    """Make the diff options JSON serializable."""
+    options = dict(options)
+    limits = options.get('limits')
+    if limits is not None:
+        options['limits'] = dict(vars(limits))
+    return options
+
+def decode_options(options):
+    options = dict((str(key), value) for key, value in options.items())
+    if options.get('limits') is not None:
+        from htmltreediff.limits import DiffLimits
+        limits = dict((str(key), value) for key, value in options['limits'].items())
+        options['limits'] = DiffLimits(**limits)
+    return options
+
+def encode_html(html):
+    """
+    Encode the html for JSON, so that decode_html() gives back exactly the
+    same string, of the same type.
+    """
+    if isinstance(html, unicode):
+        return {'type': 'unicode', 'data': html}
+    try:
+        return {'type': 'utf-8', 'data': html.decode('utf-8')}
+    except UnicodeDecodeError:
+        return {'type': 'base64', 'data': base64.b64encode(html)}
+
+def decode_html(encoded):
+    if encoded['type'] == 'unicode':
+        return encoded['data']
+    if encoded['type'] == 'utf-8':
+        return encoded['data'].encode('utf-8')
+    return base64.b64decode(encoded['data'])
+
+def load_case(path):
+    """
+    Read a capture file, and return a dictionary with the keys of the
+    capture, with the html and the options decoded.
+    """
+    with open(path) as f:
+        case = json.load(f)
+    case['old'] = decode_html(case['old'])
+    case['new'] = decode_html(case['new'])
+    case['options'] = decode_options(case['options'])
+    return case
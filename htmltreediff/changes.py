@@ -1,48 +1,70 @@
+
 from htmltreediff.text import split_text
 from htmltreediff.util import (
     is_text,
     is_element,
-    ancestors,
     walk_dom,
     remove_node,
+    replace_with_nodes,
     insert_or_append,
     wrap,
     wrap_inner,
     unwrap,
+    set_children,
 )
 from htmltreediff.diff_core import Differ
-from htmltreediff.edit_script_runner import EditScriptRunner
+from htmltreediff.stats import null_stats
+
+def split_text_nodes(dom, limits=None):
+    """
+    Split all the text nodes in the dom, and return the list of significant
+    words found, in document order.
 
-def split_text_nodes(dom):
-    for text_node in list(walk_dom(dom)):
+    If limits are given, raise DiffTooLarge as soon as the text is split into
+    more than limits.max_tokens pieces.
+    """
+    words = []
+    token_count = 0
+    for text_node in walk_dom(dom, snapshot=True):
         if not is_text(text_node):
             continue
-        split_node(text_node)
+        pieces = split_text(text_node.nodeValue)
+        if limits is not None:
+            token_count += len(pieces)
+            limits.check_tokens(token_count)
+        for piece in split_node(text_node, pieces):
+            piece = piece.strip()
+            if piece:
+                words.append(piece)
+    return words
 
-def split_node(node):
-    # Split text node in into user-friendly chunks.
-    pieces = split_text(node.nodeValue)
+def split_node(node, pieces=None):
+    # Split text node in into user-friendly chunks, and return the pieces.
+    if pieces is None:
+        pieces = split_text(node.nodeValue)
     if len(pieces) <= 1:
-        return
-    parent = node.parentNode
-    for piece in pieces:
-        piece_node = node.ownerDocument.createTextNode(piece)
-        parent.insertBefore(piece_node, node)
-    remove_node(node)
-
-def dom_diff(old_dom, new_dom):
-    # Split all the text nodes in the old and new dom.
-    split_text_nodes(old_dom)
-    split_text_nodes(new_dom)
-
-    # Get the edit script from the diff algorithm
-    differ = Differ(old_dom, new_dom)
-    edit_script = differ.get_edit_script()
-    # Run the edit script, then use the inserted and deleted nodes metadata to
-    #     show changes.
-    runner = EditScriptRunner(old_dom, edit_script)
-    dom = runner.run_edit_script()
-    add_changes_markup(dom, runner.ins_nodes, runner.del_nodes)
+        return pieces
+    document = node.ownerDocument
+    replace_with_nodes(node, [document.createTextNode(piece) for piece in pieces])
+    return pieces
+
+def dom_diff(old_dom, new_dom, split=True, cancel=None, stats=null_stats):
+    # Split all the text nodes in the old and new dom, unless the caller has
+    # already done it.
+    if split:
+        with stats.phase('split_text_nodes'):
+            split_text_nodes(old_dom)
+            split_text_nodes(new_dom)
+
+    # Change the old dom into the new one. The differ keeps the inserted and
+    # deleted nodes, which are used to show the changes, so no edit script
+    # is needed.
+    with stats.phase('differ'):
+        differ = Differ(old_dom, new_dom, cancel=cancel, copy=False, edit_script=False,
+                        ranges=True)
+        dom = differ.run()
+    with stats.phase('changes_markup'):
+        add_changes_markup(dom, differ.ins_nodes, differ.del_nodes)
     return dom
 
 def add_changes_markup(dom, ins_nodes, del_nodes):
@@ -58,71 +80,208 @@ def add_changes_markup(dom, ins_nodes, del_nodes):
     for node in ins_nodes:
         wrap(node, 'ins')
     # Perform post-processing and cleanup.
-    remove_nesting(dom, 'del')
-    remove_nesting(dom, 'ins')
-    sort_del_before_ins(dom)
-    merge_adjacent(dom, 'del')
-    merge_adjacent(dom, 'ins')
+    cleanup_changes_markup(dom)
 
-def remove_nesting(dom, tag_name):
+def cleanup_changes_markup(dom):
     """
-    Unwrap items in the node list that have ancestors with the same tag.
+    Clean up the <ins> and <del> tags in the dom, in a single pass over it.
+
+    Tags nested inside a tag of the same name are unwrapped, del tags are
+    moved before the ins tags next to them, and adjacent tags of the same name
+    are merged.
+
+    >>> from htmltreediff.util import parse_minidom, minidom_tostring
+    >>> dom = parse_minidom(
+    ...     '<ins>one <ins>two</ins></ins><del>three</del><del>four</del>')
+    >>> cleanup_changes_markup(dom)
+    >>> minidom_tostring(dom)
+    '<del>threefour</del><ins>one two</ins>'
+    """
+    # Nested tags are unwrapped, text nodes are normalized, and del tags are
+    # sorted on the way down, since that only needs the ancestors of a node.
+    # Adjacent tags are merged on the way back up, once their contents are
+    # done.
+    stack = [(dom.documentElement, False, False, False)]
+    while stack:
+        node, in_del, in_ins, children_done = stack.pop()
+        if children_done:
+            children = _merge_adjacent_changes(node.childNodes, ['del', 'ins'])
+            if len(children) != len(node.childNodes):
+                set_children(node, children)
+            continue
+        children = _del_before_ins(_unnest_children(node, in_del, in_ins))
+        set_children(node, children)
+        stack.append((node, in_del, in_ins, True))
+        for child in children:
+            if is_element(child):
+                stack.append((
+                    child,
+                    in_del or child.tagName == 'del',
+                    in_ins or child.tagName == 'ins',
+                    False,
+                ))
+
+def _unnest_children(node, in_del, in_ins):
+    """
+    Return the children of the node, with the ins and del tags that are
+    inside a tag of the same name unwrapped, and with adjacent text nodes
+    joined and empty text nodes left out, like dom.normalize() does.
     """
-    for node in dom.getElementsByTagName(tag_name):
-        for ancestor in ancestors(node):
-            if ancestor is node:
+    children = []
+    # The pieces of the text node at the end of the children, which are
+    # joined at once, since adding them one at a time takes quadratic time.
+    text = []
+    pending = list(reversed(node.childNodes))
+    while pending:
+        child = pending.pop()
+        if is_element(child) and (
+                (in_del and child.tagName == 'del') or
+                (in_ins and child.tagName == 'ins')):
+            grandchildren = list(child.childNodes)
+            set_children(child, [])
+            pending.extend(reversed(grandchildren))
+        elif is_text(child):
+            if not child.data:
                 continue
-            if ancestor is dom.documentElement:
-                break
-            if ancestor.tagName == tag_name:
-                unwrap(node)
-                break
+            if text:
+                text.append(child.data)
+            else:
+                children.append(child)
+                text = [child.data]
+        else:
+            _join_text(children, text)
+            text = []
+            children.append(child)
+    _join_text(children, text)
+    return children
+
+def _join_text(children, text):
+    if len(text) > 1:
+        children[-1].data = ''.join(text)
 
-def sort_nodes(dom, cmp_func):
+def _del_before_ins(nodes):
     """
-    Sort the nodes of the dom in-place, based on a comparison function.
+    Move the del tags before the ins tags in each run of adjacent ins and del
+    tags, keeping their order otherwise.
     """
+    result = []
+    dels = []
+    inses = []
+    for node in nodes:
+        if is_element(node) and node.tagName == 'del':
+            dels.append(node)
+        elif is_element(node) and node.tagName == 'ins':
+            inses.append(node)
+        else:
+            result.extend(dels)
+            result.extend(inses)
+            result.append(node)
+            dels = []
+            inses = []
+    result.extend(dels)
+    result.extend(inses)
+    return result
+
+def _merge_adjacent_changes(nodes, tag_names):
+    """
+    Merge the runs of adjacent elements with the same tag name, for the given
+    tag names, and return the list of nodes that is left.
+    """
+    runs = []
+    for node in nodes:
+        if (runs and is_element(node) and node.tagName in tag_names and
+                is_element(runs[-1][0]) and runs[-1][0].tagName == node.tagName):
+            runs[-1].append(node)
+        else:
+            runs.append([node])
+    merged = []
+    for run in runs:
+        first = run[0]
+        if len(run) > 1:
+            contents = []
+            for node in run:
+                contents.extend(node.childNodes)
+                set_children(node, [])
+            if first.tagName == 'del':
+                # Joining the contents of del tags can make ins tags adjacent.
+                contents = _merge_adjacent_changes(contents, ['ins'])
+            set_children(first, contents)
+        merged.append(first)
+    return merged
+
+def sort_nodes(dom, cmp_func=None, **kwargs):
+    """
+    Sort the children of each element of the dom in-place.
+
+    cmp_func(a, b) compares two sibling nodes, and each element is moved
+    back past the siblings that compare greater than it; the other nodes
+    aren't moved. Give a key function as the key keyword argument instead for
+    a stable sort that doesn't compare each pair of nodes. key(node) returns
+    the sort key of a node, or None for a node that stays where it is. The
+    nodes that stay split the children into runs, and each run is sorted on
+    its own.
+
+    >>> from htmltreediff.util import parse_minidom, minidom_tostring
+    >>> dom = parse_minidom('<b>2</b><i>1</i><b>3</b> <i>5</i><b>4</b>')
+    >>> def key(node):
+    ...     if is_element(node):
+    ...         return node.firstChild.data
+    >>> sort_nodes(dom, key=key)
+    >>> minidom_tostring(dom)
+    '<i>1</i><b>2</b><b>3</b> <b>4</b><i>5</i>'
+    """
+    key = kwargs.pop('key', None)
+    if kwargs:
+        raise TypeError('Unexpected keyword arguments: %s' % ', '.join(kwargs))
+    if (cmp_func is None) == (key is None):
+        raise TypeError('Give either cmp_func or key.')
     dom.normalize()
-    for node in list(walk_dom(dom, elements_only=True)):
-        prev_sib = node.previousSibling
-        while prev_sib and cmp_func(prev_sib, node) == 1:
-            node.parentNode.insertBefore(node, prev_sib)
-            prev_sib = node.previousSibling
+    for node in walk_dom(dom, elements_only=True, snapshot=True):
+        # Rebuild the list of children at once; minidom's insertBefore
+        # searches the whole list of children for each node that it moves.
+        if cmp_func is not None:
+            children = _insertion_sort(node.childNodes, cmp_func)
+        else:
+            children = []
+            run = []
+            for child in node.childNodes:
+                if key(child) is None:
+                    children.extend(sorted(run, key=key))
+                    children.append(child)
+                    run = []
+                else:
+                    run.append(child)
+            children.extend(sorted(run, key=key))
+        set_children(node, children)
+
+def _insertion_sort(nodes, cmp_func):
+    result = []
+    for node in nodes:
+        i = len(result)
+        if is_element(node):
+            while i > 0 and cmp_func(result[i - 1], node) == 1:
+                i -= 1
+        result.insert(i, node)
+    return result
 
 def sort_del_before_ins(dom):
-    def node_cmp(a, b):
-        try:
-            if a.tagName == 'del' and b.tagName == 'ins':
-                return -1 #TODO: line not covered
-            if a.tagName == 'ins' and b.tagName == 'del':
-                return 1
-        except AttributeError:
-            pass
-        return 0
-    sort_nodes(dom, cmp_func=node_cmp)
-
-def merge_adjacent(dom, tag_name):
-    """
-    Merge all adjacent tags with the specified tag name.
-    Return the number of merges performed.
-    """
-    for node in dom.getElementsByTagName(tag_name):
-        prev_sib = node.previousSibling
-        if prev_sib and prev_sib.nodeName == node.tagName:
-            for child in list(node.childNodes):
-                prev_sib.appendChild(child)
-            remove_node(node)
+    """
+    Move the del tags before the ins tags in each run of adjacent ins and del
+    tags.
+    """
+    dom.normalize()
+    for node in walk_dom(dom, elements_only=True, snapshot=True):
+        set_children(node, _del_before_ins(node.childNodes))
 
 def distribute(node):
     """
     Wrap a copy of the given element around the contents of each of its
-    children, removing the node in the process.
+    children, removing the node in the process. Return the new copies.
     """
     children = list(c for c in node.childNodes if is_element(c))
     unwrap(node)
     tag_name = node.tagName
-    for c in children:
-        wrap_inner(c, tag_name)
+    return [wrap_inner(c, tag_name) for c in children]
 
 def _strip_changes_new(node):
     for ins_node in node.getElementsByTagName('ins'):
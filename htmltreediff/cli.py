@@ -1,14 +1,83 @@
 import sys
-from htmltreediff import diff
+import argparse
 
 def main(argv=None):
     if not argv:
         argv = sys.argv # pragma: no cover
-    with open(argv[1]) as file_a:
+    if len(argv) > 1 and argv[1] == 'batch':
+        from htmltreediff.batch import main as batch_main
+        return batch_main(list(argv[2:]))
+    if len(argv) > 1 and argv[1] == 'serve':
+        from htmltreediff.server import main as serve_main
+        return serve_main(list(argv[2:]))
+    if len(argv) > 1 and argv[1] == 'replay':
+        from htmltreediff.replay import main as replay_main
+        return replay_main(list(argv[2:]))
+
+    parser = argparse.ArgumentParser(
+        prog='htmltreediff',
+        description='Show the differences between two html files.',
+    )
+    parser.add_argument('old_file')
+    parser.add_argument('new_file')
+    parser.add_argument('--profile', metavar='PATH',
+                        help='profile the diff, and write cProfile stats to PATH')
+    parser.add_argument('--collapsed', metavar='PATH',
+                        help='profile the diff, and write collapsed stacks for flamegraphs to PATH')
+    parser.add_argument('--repeat', type=int, metavar='N',
+                        help='run the diff N times, and report the min and median times')
+    parser.add_argument('--stats', action='store_true',
+                        help='report the time and work of each phase of the diff')
+    parser.add_argument('--memory', action='store_true',
+                        help='report the memory use after each phase of the diff')
+    args = parser.parse_args(list(argv[1:]))
+
+    with open(args.old_file) as file_a:
         html_a = file_a.read()
-    with open(argv[2]) as file_b:
+    with open(args.new_file) as file_b:
         html_b = file_b.read()
-    print diff(html_a, html_b, cutoff=0.0, pretty=True)
+    options = dict(cutoff=0.0, pretty=True)
+
+    profiling = args.profile or args.collapsed or args.repeat
+    changes = None
+    if not (profiling or args.stats or args.memory):
+        # If a diff server is running, let it do the work, without importing
+        # the diff here.
+        from htmltreediff.server import try_server_diff
+        changes = try_server_diff(html_a, html_b, **options)
+    if changes is None:
+        from htmltreediff.html import diff
+        if args.stats or args.memory:
+            from htmltreediff.stats import DiffStats
+            stats = DiffStats(memory=args.memory)
+            changes = diff(html_a, html_b, stats=stats, **options)
+            sys.stderr.write(stats.report() + '\n')
+        else:
+            changes = diff(html_a, html_b, **options)
+    if profiling:
+        profile(args, html_a, html_b, options)
+    if isinstance(changes, unicode):
+        changes = changes.encode('utf-8')
+    print changes
+
+def profile(args, html_a, html_b, options):
+    from htmltreediff.html import diff
+    from htmltreediff.profiling import (
+        profile_call,
+        StackProfiler,
+        time_repeats,
+        median,
+    )
+    if args.profile:
+        profile_call(args.profile, diff, html_a, html_b, **options)
+    if args.collapsed:
+        profiler = StackProfiler()
+        profiler.runcall(diff, html_a, html_b, **options)
+        profiler.write_collapsed(args.collapsed)
+    if args.repeat:
+        times = time_repeats(args.repeat, diff, html_a, html_b, **options)
+        sys.stderr.write('%d runs: min %.2f ms, median %.2f ms\n' % (
+            len(times), min(times) * 1000, median(times) * 1000))
 
 if __name__ == '__main__':
-    main() # pragma: no cover
+    sys.exit(main()) # pragma: no cover
@@ -2,8 +2,10 @@ import difflib
 from xml.dom import Node
 
 from htmltreediff.text import is_text_junk
+from htmltreediff.stats import active_stats
 from htmltreediff.util import (
     copy_dom,
+    copy_tree,
     HashableTree,
     FuzzyHashableTree,
     is_text,
@@ -11,6 +13,8 @@ from htmltreediff.util import (
     get_location,
     remove_node,
     insert_or_append,
+    insert_children,
+    remove_children,
     attribute_dict,
     walk_dom,
 )
@@ -25,11 +29,66 @@ def fuzzy_match_node_hash(node):
         return node.nodeValue
     return FuzzyHashableTree(node)
 
+class DiffCancelled(Exception):
+    """The diff was cancelled before it could finish."""
+
 class Differ():
-    def __init__(self, old_dom, new_dom):
+    """
+    Change old_dom into new_dom, one node at a time.
+
+    The changes can be written out as an edit script, with get_edit_script().
+    They are also kept as nodes: after run(), ins_nodes is the list of nodes
+    inserted into old_dom, and del_nodes the list of nodes deleted from it,
+    in the order the changes were made. Each of these nodes has orig_parent
+    and orig_next_sibling attributes, for where in old_dom it was inserted or
+    deleted, like EditScriptRunner gives when running the edit script.
+
+    By default the doms are copied first. If copy is False, old_dom itself is
+    changed into new_dom; new_dom is never changed. If edit_script is False,
+    no edit script is written.
+
+    If ranges is True, whole subtrees are inserted, and ranges of siblings
+    deleted, at once. The edit script then has insert_subtree and
+    delete_range operations, and ins_nodes and del_nodes only have the top
+    nodes of the inserted and deleted subtrees.
+    """
+    def __init__(self, old_dom, new_dom, cancel=None, copy=True, edit_script=True,
+                 ranges=False):
+        if edit_script:
+            self.edit_script = []
+        else:
+            self.edit_script = None
+        if copy:
+            old_dom = copy_dom(old_dom)
+            new_dom = copy_dom(new_dom)
+        self.old_dom = old_dom
+        self.new_dom = new_dom
+        self.ins_nodes = []
+        self.del_nodes = []
+        self.ranges = ranges
+        # An optional object with an is_set() method, like threading.Event.
+        # It is checked once per location, and the diff stops with
+        # DiffCancelled as soon as it is set.
+        self.cancel = cancel
+        self.stats = active_stats()
+
+    def run(self):
+        """Change old_dom into new_dom, and return old_dom."""
+        # start diff at the body element
+        self.diff_location([], [])
+        return self.old_dom
+
+    def iter_edit_script(self):
+        """
+        Yield the operations of the edit script as they are found, instead of
+        returning them all at once, like get_edit_script() does. Only the
+        operations for the children of one node are kept at a time.
+        """
         self.edit_script = []
-        self.old_dom = copy_dom(old_dom)
-        self.new_dom = copy_dom(new_dom)
+        for _ in self.iter_diff_location([], []):
+            for operation in self.edit_script:
+                yield operation
+            del self.edit_script[:]
 
     def get_edit_script(self):
         """
@@ -45,50 +104,120 @@ class Differ():
         The node properties is a dictionary possibly containing keys:
             {node_type, tag_name, attributes, node_value.}
         Any properties that would be empty may be ommitted. attributes is an attribute dictionary.
+
+        With ranges, the actions are instead:
+        - ('delete_range', location, {'count': count})
+            delete count siblings starting at the location, and all their
+            descendants
+        - ('insert_subtree', location, subtree_properties)
+            insert the node and its descendants at the given location. The
+            properties have an extra children key, with the properties of
+            the children, if there are any.
         """
-        # start diff at the body element
-        self.diff_location([], [])
+        self.run()
         return self.edit_script
 
     def diff_location(self, old_location, new_location):
+        for _ in self.iter_diff_location(old_location, new_location):
+            pass
+
+    def iter_diff_location(self, old_location, new_location):
+        """
+        Diff the children of the locations, and everything below them,
+        yielding after the changes to each list of children are made.
+        """
         # Here we match up the children of the given locations. This is done in
         # three steps. First we use full tree equality to match up children
         # that are identical all the way down. Then, we use a heuristic
         # function to match up children that are similar, based on text
         # content. Lastly, we just use node tag types to match up elements. For
         # the text-similar matches and the tag-only matches, we still have more
-        # work to do, so we recurse on these. The non-matching parts that
+        # work to do, so we go deeper on these. The non-matching parts that
         # remain are used to output edit script entries.
-        old_children = list(get_location(self.old_dom, old_location).childNodes)
-        new_children = list(get_location(self.new_dom, new_location).childNodes)
+        #
+        # Instead of recursing, the locations still to be diffed are kept on a
+        # stack, so that deep documents don't hit the recursion limit. They
+        # are popped in the same order that recursion would visit them.
+        #
+        # Once the changes for a level are applied, the matched children are
+        # at the same index in the old and new dom, so a single path serves
+        # for both. Paths are linked lists of (parent_path, index) pairs,
+        # which share their prefixes, and are only turned into location lists
+        # for the edit script.
+        assert old_location == new_location
+        stack = [(
+            get_location(self.old_dom, old_location),
+            get_location(self.new_dom, new_location),
+            make_path(old_location),
+        )]
+        while stack:
+            old_parent, new_parent, path = stack.pop()
+            matched_children = self.diff_children(old_parent, new_parent, path)
+            stack.extend(reversed(matched_children))
+            yield
+
+    def diff_children(self, old_parent, new_parent, path):
+        """
+        Write the changes to the children of the parent nodes to the edit
+        script, and return a list of tuples (old_child, new_child, path) for
+        the children that still need to be diffed.
+        """
+        if self.cancel is not None and self.cancel.is_set():
+            raise DiffCancelled()
+        self.stats.count('diff_location_calls')
+        old_children = list(old_parent.childNodes)
+        new_children = list(new_parent.childNodes)
         if not old_children and not new_children:
-            return
+            return []
 
         matching_blocks, recursion_indices = self.match_children(old_children, new_children)
 
         # Apply changes for this level.
         for tag, i1, i2, j1, j2 in adjusted_ops(get_opcodes(matching_blocks)):
-            if tag == 'delete':
+            if self.ranges:
+                if tag == 'delete':
+                    self.delete_range(old_parent, (path, i1), i2 - i1)
+                    del old_children[i1:i2]
+                elif tag == 'insert':
+                    self.insert_subtrees(old_parent, (path, i1), new_children[j1:j2])
+                    old_children[i1:i1] = new_children[j1:j2]
+            elif tag == 'delete':
                 assert j1 == j2
                 # delete range from right to left
                 for index, child in reversed(list(enumerate(old_children[i1:i2]))):
-                    self.delete(old_location + [i1 + index], child)
+                    self.delete((path, i1 + index), child)
                     old_children.pop(i1 + index)
             elif tag == 'insert':
                 assert i1 == i2
                 # insert range from left to right
                 for index, child in enumerate(new_children[j1:j2]):
-                    self.insert(new_location + [i1 + index], child)
+                    self.insert(old_parent, (path, i1 + index), child)
                     old_children.insert(i1 + index, child)
             recursion_indices = list(adjust_indices(recursion_indices, i1, i2, j1, j2))
 
-        # Recurse to deeper level.
+        # Go deeper on the fuzzy matches.
+        matched_children = []
         for old_index, new_index in recursion_indices:
-            self.diff_location(old_location + [old_index], new_location + [new_index])
+            assert old_index == new_index
+            matched_children.append((
+                old_parent.childNodes[old_index],
+                new_children[new_index],
+                (path, new_index),
+            ))
+        return matched_children
 
     def match_children(self, old_children, new_children):
+        old_hashes = [match_node_hash(c) for c in old_children]
+        new_hashes = [match_node_hash(c) for c in new_children]
+        if old_hashes == new_hashes:
+            # Identical children match as a whole. This is what difflib finds
+            # too, but it can take quadratic time to do so, when there are
+            # many junk nodes, like the spaces between the words of a text.
+            size = len(old_children)
+            return [(0, 0, size), (size, size, 0)], []
+
         # Find whole-tree matches and fuzzy matches.
-        sm = match_blocks(match_node_hash, old_children, new_children)
+        sm = hash_match_blocks(old_hashes, new_hashes)
         # If the match is very poor, pretend there were no exact matching blocks at all.
         if sm.ratio() < 0.3:
             matching_blocks = [(len(old_children), len(new_children), 0)]
@@ -127,36 +256,133 @@ class Differ():
 
         return matching_blocks, recursion_indices
 
-    def delete(self, location, node):
+    def delete(self, path, node):
         # delete from the bottom up, children before parent, right to left
-        for child_index, child in reversed(list(enumerate(node.childNodes))):
-            self.delete(location + [child_index], child)
-        # write deletion to the edit script
-        self.edit_script.append((
-            'delete',
-            location,
-            node_properties(node),
-        ))
-        # actually delete the node
-        assert node.parentNode == get_location(self.old_dom, location[:-1])
-        assert node.ownerDocument == self.old_dom
-        remove_node(node)
-
-    def insert(self, location, node):
-        # write insertion to the edit script
-        self.edit_script.append((
-            'insert',
-            location,
-            node_properties(node),
-        ))
-        # actually insert the node
-        node_copy = node.cloneNode(deep=False)
-        parent = get_location(self.old_dom, location[:-1])
-        next_sibling = get_child(parent, location[-1])
-        insert_or_append(parent, node_copy, next_sibling)
+        stack = [(path, node, False)]
+        while stack:
+            path, node, children_deleted = stack.pop()
+            if not children_deleted:
+                stack.append((path, node, True))
+                for child_index, child in enumerate(node.childNodes):
+                    stack.append(((path, child_index), child, False))
+                continue
+            # write deletion to the edit script
+            self.stats.count('delete_ops')
+            if self.edit_script is not None:
+                self.edit_script.append((
+                    'delete',
+                    path_location(path),
+                    node_properties(node),
+                ))
+            # actually delete the node
+            assert node.ownerDocument is self.old_dom
+            node.orig_parent = node.parentNode
+            node.orig_next_sibling = node.nextSibling
+            remove_node(node)
+            self.del_nodes.append(node)
+
+    def insert(self, parent, path, node):
         # insert from the top down, parent before children, left to right
-        for child_index, child in enumerate(node.childNodes):
-            self.insert(location + [child_index], child)
+        stack = [(parent, path, node)]
+        while stack:
+            parent, path, node = stack.pop()
+            # write insertion to the edit script
+            self.stats.count('insert_ops')
+            if self.edit_script is not None:
+                self.edit_script.append((
+                    'insert',
+                    path_location(path),
+                    node_properties(node),
+                ))
+            # actually insert the node
+            node_copy = self.old_dom.importNode(node, False)
+            next_sibling = get_child(parent, path[1])
+            insert_or_append(parent, node_copy, next_sibling)
+            node_copy.orig_parent = parent
+            node_copy.orig_next_sibling = next_sibling
+            self.ins_nodes.append(node_copy)
+            for child_index in reversed(range(len(node.childNodes))):
+                stack.append((node_copy, (path, child_index), node.childNodes[child_index]))
+
+    def delete_range(self, parent, path, count):
+        """Delete count children of the parent, starting at the path."""
+        self.stats.count('delete_ops')
+        if self.edit_script is not None:
+            self.edit_script.append((
+                'delete_range',
+                path_location(path),
+                {'count': count},
+            ))
+        nodes = remove_children(parent, path[1], count)
+        next_sibling = get_child(parent, path[1])
+        # Keep the nodes in the order that deleting them one by one, from
+        # right to left, would give.
+        for node in reversed(nodes):
+            assert node.ownerDocument is self.old_dom
+            node.orig_parent = parent
+            node.orig_next_sibling = next_sibling
+            self.del_nodes.append(node)
+
+    def insert_subtrees(self, parent, path, nodes):
+        """
+        Insert copies of the nodes from the new dom, with their descendants,
+        as children of the parent, starting at the path.
+        """
+        parent_path, index = path
+        copies = []
+        for offset, node in enumerate(nodes):
+            self.stats.count('insert_ops')
+            if self.edit_script is not None:
+                self.edit_script.append((
+                    'insert_subtree',
+                    path_location((parent_path, index + offset)),
+                    subtree_properties(node),
+                ))
+            copies.append(copy_tree(self.old_dom, node))
+        next_sibling = get_child(parent, index)
+        insert_children(parent, index, copies)
+        for node_copy in copies:
+            node_copy.orig_parent = parent
+            node_copy.orig_next_sibling = next_sibling
+            self.ins_nodes.append(node_copy)
+
+def iter_edit_script(old_dom, new_dom, cancel=None, ranges=False):
+    """
+    Yield the operations of the edit script from old_dom to new_dom, as they
+    are found. See Differ.get_edit_script() for the operations.
+
+    >>> from htmltreediff.util import parse_minidom
+    >>> for operation in iter_edit_script(
+    ...         parse_minidom('<h1>one</h1>'), parse_minidom('<h1>two</h1>'),
+    ...         ranges=True):
+    ...     print operation[:2]
+    ('delete_range', [0])
+    ('insert_subtree', [0])
+    """
+    return Differ(old_dom, new_dom, cancel=cancel, ranges=ranges).iter_edit_script()
+
+def make_path(location):
+    """
+    Turn a location list into a path.
+
+    >>> make_path([1, 2])
+    ((None, 1), 2)
+    >>> path_location(make_path([1, 2]))
+    [1, 2]
+    """
+    path = None
+    for index in location:
+        path = (path, index)
+    return path
+
+def path_location(path):
+    """Turn a path into a location list."""
+    location = []
+    while path is not None:
+        path, index = path
+        location.append(index)
+    location.reverse()
+    return location
 
 def adjusted_ops(opcodes):
     """
@@ -221,6 +447,30 @@ def node_properties(node):
             del d[key]
     return d
 
+def subtree_properties(node):
+    """
+    Return the node properties of the node, with the properties of its
+    children, and theirs, under the children key.
+
+    >>> from htmltreediff.util import parse_minidom
+    >>> dom = parse_minidom('<p>one</p>')
+    >>> subtree_properties(dom.documentElement.firstChild) == {
+    ...     'node_type': 1, 'node_name': 'p',
+    ...     'children': [{'node_type': 3, 'node_value': 'one'}]}
+    True
+    """
+    # Go through the tree with an explicit stack, since it can be deeper
+    # than the recursion limit.
+    root = node_properties(node)
+    stack = [(node, root)]
+    while stack:
+        node, properties = stack.pop()
+        if node.childNodes:
+            children = [node_properties(child) for child in node.childNodes]
+            properties['children'] = children
+            stack.extend(zip(node.childNodes, children))
+    return root
+
 def match_indices(match):
     """Yield index tuples (old_index, new_index) for each place in the match."""
     a, b, size = match
@@ -245,12 +495,15 @@ def _is_junk(hashable_node):
 
 def match_blocks(hash_func, old_children, new_children):
     """Use difflib to find matching blocks."""
-    sm = difflib.SequenceMatcher(
-        _is_junk,
-        a=[hash_func(c) for c in old_children],
-        b=[hash_func(c) for c in new_children],
+    return hash_match_blocks(
+        [hash_func(c) for c in old_children],
+        [hash_func(c) for c in new_children],
     )
-    return sm
+
+def hash_match_blocks(old_hashes, new_hashes):
+    """Use difflib to find matching blocks of the hashed nodes."""
+    active_stats().count('sequence_matchers')
+    return difflib.SequenceMatcher(_is_junk, a=old_hashes, b=new_hashes)
 
 def get_nonmatching_blocks(matching_blocks):
     """Given a list of matching blocks, output the gaps between them.
@@ -0,0 +1,270 @@
+"""
+A compact binary form of edit scripts, for storing them, for example as the
+deltas between the revisions of a document.
+
+>>> from htmltreediff.util import parse_minidom, minidom_tostring
+>>> from htmltreediff.diff_core import Differ
+>>> old_dom = parse_minidom('<h1>one</h1><p>two</p>')
+>>> new_dom = parse_minidom('<h1>one</h1><p>three</p>')
+>>> edit_script = Differ(old_dom, new_dom).get_edit_script()
+>>> data = encode_edit_script(edit_script)
+>>> decode_edit_script(data) == edit_script
+True
+>>> minidom_tostring(apply_edit_script(old_dom, data))
+u'<h1>one</h1><p>three</p>'
+
+Applying the encoded script is faster than decoding it and running it with
+EditScriptRunner, since no properties dictionaries are made, and the nodes
+along the path to the previous change are reused to find the next one.
+
+The format is:
+    * the header, 'HTDE' and a version byte,
+    * the string table: the number of strings, then each string as its
+      length and its utf-8 bytes. Each tag name, attribute name and value,
+      and text value is stored once, and referred to by its index.
+    * the number of operations, then each operation:
+        * a byte of flags: whether it is an insert, and which of the node
+          properties follow,
+        * the number of leading indices that the location shares with the
+          location of the previous operation, then the number of remaining
+          indices, then the remaining indices,
+        * the node type, the index of the node name, the index of the node
+          value, and the number of attributes followed by the indices of
+          their names and values, for those properties that are present.
+All the numbers are unsigned varints, seven bits to a byte, least
+significant first.
+"""
+
+from xml.dom import Node
+
+from htmltreediff.util import insert_child, remove_child
+
+MAGIC = 'HTDE'
+VERSION = 1
+
+# Operation flags.
+INSERT = 1
+HAS_TYPE = 2
+HAS_NAME = 4
+HAS_VALUE = 8
+HAS_ATTRIBUTES = 16
+
+_property_flags = {
+    'node_type': HAS_TYPE,
+    'node_name': HAS_NAME,
+    'node_value': HAS_VALUE,
+    'attributes': HAS_ATTRIBUTES,
+}
+
+def _write_varint(out, number):
+    if number < 0:
+        raise ValueError('Negative numbers can not be encoded: %d' % number)
+    while number > 0x7f:
+        out.append((number & 0x7f) | 0x80)
+        number >>= 7
+    out.append(number)
+
+def encode_edit_script(edit_script):
+    """Encode an edit script from Differ.get_edit_script() as a byte string."""
+    strings = []
+    string_indices = {}
+    def intern(string):
+        index = string_indices.get(string)
+        if index is None:
+            index = string_indices[string] = len(strings)
+            strings.append(string)
+        return index
+
+    ops = bytearray()
+    _write_varint(ops, len(edit_script))
+    previous_location = []
+    for action, location, properties in edit_script:
+        flags = 0
+        if action == 'insert':
+            flags |= INSERT
+        elif action != 'delete':
+            raise ValueError('Unknown edit script action: %r' % action)
+        for key in properties:
+            try:
+                flags |= _property_flags[key]
+            except KeyError:
+                raise ValueError('Unknown node property: %r' % key)
+        ops.append(flags)
+
+        shared = 0
+        for a, b in zip(previous_location, location):
+            if a != b:
+                break
+            shared += 1
+        _write_varint(ops, shared)
+        _write_varint(ops, len(location) - shared)
+        for index in location[shared:]:
+            _write_varint(ops, index)
+        previous_location = location
+
+        if flags & HAS_TYPE:
+            _write_varint(ops, properties['node_type'])
+        if flags & HAS_NAME:
+            _write_varint(ops, intern(properties['node_name']))
+        if flags & HAS_VALUE:
+            _write_varint(ops, intern(properties['node_value']))
+        if flags & HAS_ATTRIBUTES:
+            attributes = sorted(properties['attributes'].items())
+            _write_varint(ops, len(attributes))
+            for name, value in attributes:
+                _write_varint(ops, intern(name))
+                _write_varint(ops, intern(value))
+
+    out = bytearray(MAGIC)
+    out.append(VERSION)
+    _write_varint(out, len(strings))
+    for string in strings:
+        data = string.encode('utf-8')
+        _write_varint(out, len(data))
+        out.extend(data)
+    out.extend(ops)
+    return str(out)
+
+class _Reader(object):
+    def __init__(self, data):
+        self.data = bytearray(data)
+        self.position = 0
+
+    def varint(self):
+        data = self.data
+        position = self.position
+        number = 0
+        shift = 0
+        try:
+            while True:
+                byte = data[position]
+                position += 1
+                number |= (byte & 0x7f) << shift
+                if byte < 0x80:
+                    break
+                shift += 7
+        except IndexError:
+            raise ValueError('The encoded edit script is truncated.')
+        self.position = position
+        return number
+
+    def byte(self):
+        try:
+            byte = self.data[self.position]
+        except IndexError:
+            raise ValueError('The encoded edit script is truncated.')
+        self.position += 1
+        return byte
+
+    def string(self):
+        length = self.varint()
+        end = self.position + length
+        if end > len(self.data):
+            raise ValueError('The encoded edit script is truncated.')
+        string = self.data[self.position:end].decode('utf-8')
+        self.position = end
+        return string
+
+def _iter_ops(data):
+    """
+    Yield a tuple (flags, location, node_type, node_name, node_value,
+    attributes) for each operation in the encoded edit script. The
+    properties that are not present are None.
+    """
+    reader = _Reader(data)
+    if str(reader.data[:len(MAGIC)]) != MAGIC:
+        raise ValueError('Not an encoded edit script.')
+    reader.position = len(MAGIC)
+    version = reader.byte()
+    if version != VERSION:
+        raise ValueError('Unknown edit script version: %d' % version)
+    strings = [reader.string() for _ in range(reader.varint())]
+
+    location = []
+    for _ in range(reader.varint()):
+        flags = reader.byte()
+        shared = reader.varint()
+        location = location[:shared]
+        for _ in range(reader.varint()):
+            location.append(reader.varint())
+        node_type = node_name = node_value = attributes = None
+        try:
+            if flags & HAS_TYPE:
+                node_type = reader.varint()
+            if flags & HAS_NAME:
+                node_name = strings[reader.varint()]
+            if flags & HAS_VALUE:
+                node_value = strings[reader.varint()]
+            if flags & HAS_ATTRIBUTES:
+                attributes = {}
+                for _ in range(reader.varint()):
+                    name = strings[reader.varint()]
+                    attributes[name] = strings[reader.varint()]
+        except IndexError:
+            raise ValueError('The encoded edit script refers to a missing string.')
+        yield flags, location, node_type, node_name, node_value, attributes
+    if reader.position != len(reader.data):
+        raise ValueError('The encoded edit script has trailing data.')
+
+def decode_edit_script(data):
+    """Decode an edit script made by encode_edit_script()."""
+    edit_script = []
+    for flags, location, node_type, node_name, node_value, attributes in _iter_ops(data):
+        properties = {}
+        if flags & HAS_TYPE:
+            properties['node_type'] = node_type
+        if flags & HAS_NAME:
+            properties['node_name'] = node_name
+        if flags & HAS_VALUE:
+            properties['node_value'] = node_value
+        if flags & HAS_ATTRIBUTES:
+            properties['attributes'] = attributes
+        action = flags & INSERT and 'insert' or 'delete'
+        edit_script.append((action, location, properties))
+    return edit_script
+
+def apply_edit_script(dom, data):
+    """
+    Run an encoded edit script on the dom, changing it in place, and return
+    the dom. This gives the same dom as EditScriptRunner does, without
+    keeping track of the inserted and deleted nodes.
+    """
+    # nodes[k] is the node at the first k indices of the previous location.
+    # After an operation, the nodes down to its parent are still in place,
+    # and so is an inserted node.
+    nodes = [dom.documentElement]
+    previous_location = []
+    for flags, location, node_type, node_name, node_value, attributes in _iter_ops(data):
+        if not location:
+            raise ValueError('The root node can not be changed.')
+        depth = len(location) - 1
+        shared = 0
+        for a, b in zip(previous_location, location):
+            if a != b or shared >= depth:
+                break
+            shared += 1
+        del nodes[min(shared, len(nodes) - 1) + 1:]
+        for index in location[len(nodes) - 1:depth]:
+            children = nodes[-1].childNodes
+            if index >= len(children):
+                raise ValueError('Node at location %s does not exist.' % location)
+            nodes.append(children[index])
+        parent = nodes[-1]
+        index = location[-1]
+
+        if flags & INSERT:
+            if node_type == Node.ELEMENT_NODE:
+                node = dom.createElement(node_name)
+                if attributes:
+                    for name, value in attributes.items():
+                        node.setAttribute(name, value)
+            elif node_type == Node.TEXT_NODE:
+                node = dom.createTextNode(node_value)
+            else:
+                raise ValueError('Can not insert a node of type %r.' % node_type)
+            insert_child(parent, index, node)
+            nodes.append(node)
+        else:
+            remove_child(parent, index)
+        previous_location = location
+    return dom
@@ -5,6 +5,9 @@ from htmltreediff.util import (
     get_location,
     remove_node,
     insert_or_append,
+    insert_children,
+    remove_children,
+    set_children,
 )
 
 class EditScriptRunner(object):
@@ -23,16 +26,8 @@ class EditScriptRunner(object):
         node.orig_next_sibling = next_sibling
         self.del_nodes.append(node)
 
-    def action_insert(self, parent, child_index,
-                      node_type=None, node_name=None, node_value=None, attributes=None):
-        if node_type == Node.ELEMENT_NODE:
-            node = self.dom.createElement(node_name)
-            if attributes:
-                for key, value in attributes.items():
-                    node.setAttribute(key, value)
-        elif node_type == Node.TEXT_NODE:
-            node = self.dom.createTextNode(node_value)
-        self.action_insert_node(parent, child_index, node)
+    def action_insert(self, parent, child_index, **properties):
+        self.action_insert_node(parent, child_index, self.make_node(**properties))
 
     def action_insert_node(self, parent, child_index, node):
         previous_sibling = get_child(parent, child_index - 1)
@@ -44,12 +39,59 @@ class EditScriptRunner(object):
         node.orig_next_sibling = next_sibling
         self.ins_nodes.append(node)
 
+    def action_delete_range(self, parent, child_index, count):
+        nodes = remove_children(parent, child_index, count)
+        next_sibling = get_child(parent, child_index)
+        # Record the nodes as if they were deleted one by one, from right to
+        # left.
+        for node in reversed(nodes):
+            node.orig_parent = parent
+            node.orig_next_sibling = next_sibling
+            self.del_nodes.append(node)
+
+    def action_insert_subtrees(self, parent, child_index, subtrees):
+        nodes = [self.make_subtree(properties) for properties in subtrees]
+        next_sibling = get_child(parent, child_index)
+        insert_children(parent, child_index, nodes)
+        for node in nodes:
+            node.orig_parent = parent
+            node.orig_next_sibling = next_sibling
+            self.ins_nodes.append(node)
+
+    def make_node(self, node_type=None, node_name=None, node_value=None,
+                  attributes=None, children=None):
+        if node_type == Node.ELEMENT_NODE:
+            node = self.dom.createElement(node_name)
+            if attributes:
+                for key, value in attributes.items():
+                    node.setAttribute(key, value)
+        elif node_type == Node.TEXT_NODE:
+            node = self.dom.createTextNode(node_value)
+        return node
+
+    def make_subtree(self, properties):
+        """Make a node and its descendants from subtree properties."""
+        root = self.make_node(**properties)
+        stack = [(root, properties)]
+        while stack:
+            node, properties = stack.pop()
+            children = properties.get('children')
+            if children:
+                child_nodes = [self.make_node(**child) for child in children]
+                set_children(node, child_nodes)
+                stack.extend(zip(child_nodes, children))
+        return root
+
     # script running #
     def run_edit_script(self):
         """
         Run an xml edit script, and return the new html produced.
         """
-        for action, location, properties in self.edit_script:
+        edit_script = self.edit_script
+        i = 0
+        while i < len(edit_script):
+            action, location, properties = edit_script[i]
+            i += 1
             if action == 'delete':
                 node = get_location(self.dom, location)
                 self.action_delete(node)
@@ -57,4 +99,21 @@ class EditScriptRunner(object):
                 parent = get_location(self.dom, location[:-1])
                 child_index = location[-1]
                 self.action_insert(parent, child_index, **properties)
+            elif action == 'delete_range':
+                parent = get_location(self.dom, location[:-1])
+                self.action_delete_range(parent, location[-1], properties['count'])
+            elif action == 'insert_subtree':
+                # Splice in the following subtrees too, if they go right
+                # after this one.
+                subtrees = [properties]
+                while i < len(edit_script):
+                    next_action, next_location, next_properties = edit_script[i]
+                    if (next_action != 'insert_subtree' or
+                            next_location[:-1] != location[:-1] or
+                            next_location[-1] != location[-1] + len(subtrees)):
+                        break
+                    subtrees.append(next_properties)
+                    i += 1
+                parent = get_location(self.dom, location[:-1])
+                self.action_insert_subtrees(parent, location[-1], subtrees)
         return self.dom
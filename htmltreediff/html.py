@@ -1,3 +1,5 @@
+import time
+
 from htmltreediff.util import (
     parse_minidom,
     parse_text,
@@ -5,90 +7,174 @@ from htmltreediff.util import (
     unwrap,
     wrap_inner,
     remove_node,
-    check_text_similarity,
+    check_word_similarity,
+    tree_text,
+    tag_index,
+    unique_nodes,
 )
-from htmltreediff.changes import dom_diff, distribute
+from htmltreediff.changes import dom_diff, distribute, split_text_nodes
+from htmltreediff.limits import DiffTooLarge
+from htmltreediff.stats import DiffStats, null_stats
+from htmltreediff.capture import default_capture
+
+too_large_message = '<h2>The differences from the previous version are too large to show concisely.</h2>'
 
-def diff(old_html, new_html, cutoff=0.0, plaintext=False, pretty=False):
+def diff(old_html, new_html, cutoff=0.0, plaintext=False, pretty=False,
+         cancel=None, stats=None, limits=None, capture=None):
     """Show the differences between the old and new html document, as html.
 
     Return the document html with extra tags added to show changes. Add <ins>
     tags around newly added sections, and <del> tags to show sections that have
     been deleted.
+
+    If cancel is given, it is an object with an is_set() method, like
+    threading.Event. The diff raises DiffCancelled once it is set.
+
+    If stats is given, it is a DiffStats object, which collects timings for
+    each phase of the diff.
+
+    If limits is given, it is a DiffLimits object, which sets limits on the
+    size of the documents, and what to do when they are over the limits.
+
+    If capture is given, it is a SlowDiffCapture object, which saves the
+    inputs of the diff if it is slow. By default, the one set up with
+    capture.enable_capture() is used, if any.
     """
-    if plaintext:
-        old_dom = parse_text(old_html)
-        new_dom = parse_text(new_html)
-    else:
-        old_dom = parse_minidom(old_html)
-        new_dom = parse_minidom(new_html)
+    if capture is None:
+        capture = default_capture()
+    if stats is None:
+        if capture is None:
+            stats = null_stats
+        else:
+            stats = DiffStats()
+    start = time.time()
+    with stats.activate():
+        result = _diff(old_html, new_html, cutoff, plaintext, pretty, cancel, stats, limits)
+    if capture is not None:
+        options = dict(cutoff=cutoff, plaintext=plaintext, pretty=pretty, limits=limits)
+        capture.diff_finished(old_html, new_html, options, time.time() - start, stats)
+    return result
+
+def _diff(old_html, new_html, cutoff, plaintext, pretty, cancel, stats, limits):
+    stats.record_size('old_html', len(old_html))
+    stats.record_size('new_html', len(new_html))
+
+    with stats.phase('parse'):
+        if plaintext:
+            old_dom = parse_text(old_html)
+            new_dom = parse_text(new_html)
+        else:
+            old_dom = parse_minidom(old_html)
+            new_dom = parse_minidom(new_html)
+    stats.record_dom_size('old_nodes', old_dom)
+    stats.record_dom_size('new_nodes', new_dom)
+
+    try:
+        if limits is not None:
+            limits.check_dom(old_dom)
+            limits.check_dom(new_dom)
+        # Split the text into words. The same words are used for the
+        # similarity check, so each document is only tokenized once.
+        with stats.phase('split_text_nodes'):
+            old_words = split_text_nodes(old_dom, limits)
+            new_words = split_text_nodes(new_dom, limits)
+    except DiffTooLarge, e:
+        policy = limits.policy_for(e.limit)
+        if policy == 'raise':
+            raise
+        # The text of the documents can only be diffed instead if the trees
+        # were too large, not the text.
+        if policy == 'plaintext' and not plaintext and e.limit != 'max_tokens':
+            return _diff(tree_text(old_dom), tree_text(new_dom), cutoff,
+                         True, pretty, cancel, stats, limits)
+        stats.record_size('output', len(too_large_message))
+        return too_large_message
 
     # If the two documents are not similar enough, don't show the changes.
-    if not check_text_similarity(old_dom, new_dom, cutoff):
-        return '<h2>The differences from the previous version are too large to show concisely.</h2>'
+    with stats.phase('similarity'):
+        similar = check_word_similarity(old_words, new_words, cutoff)
+    if not similar:
+        stats.record_size('output', len(too_large_message))
+        return too_large_message
 
-    dom = dom_diff(old_dom, new_dom)
+    dom = dom_diff(old_dom, new_dom, split=False, cancel=cancel, stats=stats)
 
     # HTML-specific cleanup.
     if not plaintext:
-        fix_lists(dom)
-        fix_tables(dom)
+        with stats.phase('tag_index'):
+            index = tag_index(dom, fix_up_tags)
+        with stats.phase('fix_lists'):
+            fix_lists(dom, index)
+        with stats.phase('fix_tables'):
+            fix_tables(dom, index)
 
     # Only return html for the document body contents.
     body_elements = dom.getElementsByTagName('body')
     if len(body_elements) == 1:
         dom = body_elements[0]
 
-    return minidom_tostring(dom, pretty=pretty)
+    with stats.phase('tostring'):
+        result = minidom_tostring(dom, pretty=pretty)
+    stats.record_size('output', len(result))
+    return result
 
-def fix_lists(dom):
+# The tags that fix_lists and fix_tables look for.
+fix_up_tags = ['li', 'tr', 'td', 'th', 'ins', 'del']
+
+def fix_lists(dom, index=None):
     # <ins> and <del> tags are not allowed within <ul> or <ol> tags.
     # Move them to the nearest li, so that the numbering isn't interrupted.
+    if index is None:
+        index = tag_index(dom, fix_up_tags)
+    if not index['li'] or not (index['ins'] or index['del']):
+        return
 
     # Find all del > li and ins > li sets.
-    del_tags = set()
-    ins_tags = set()
-    for node in list(dom.getElementsByTagName('li')):
+    del_tags = []
+    ins_tags = []
+    for node in index['li']:
         parent = node.parentNode
         if parent.tagName == 'del':
-            del_tags.add(parent)
+            del_tags.append(parent)
         elif parent.tagName == 'ins':
-            ins_tags.add(parent)
-    # Change ins > li into li > ins.
-    for ins_tag in ins_tags:
-        distribute(ins_tag)
+            ins_tags.append(parent)
+    # Change ins > li into li > ins. The new tags are added to the index, so
+    # that fix_tables sees them.
+    for ins_tag in unique_nodes(ins_tags):
+        index['ins'].extend(distribute(ins_tag))
     # Change del > li into li.del-li > del.
-    for del_tag in del_tags:
+    for del_tag in unique_nodes(del_tags):
         children = list(del_tag.childNodes)
         unwrap(del_tag)
         for c in children:
             if c.nodeName == 'li':
                 c.setAttribute('class', 'del-li')
-                wrap_inner(c, 'del')
+                index['del'].append(wrap_inner(c, 'del'))
 
-def fix_tables(dom):
+def fix_tables(dom, index=None):
+    if index is None:
+        index = tag_index(dom, fix_up_tags)
+    if not (index['ins'] or index['del']):
+        return
     # Show table row insertions
-    tags = set()
-    for node in list(dom.getElementsByTagName('tr')):
+    tags = []
+    for node in index['tr']:
         parent = node.parentNode
         if parent.tagName in ('ins', 'del'):
-            tags.add(parent)
-    for tag in tags:
-        distribute(tag)
+            tags.append(parent)
+    for tag in unique_nodes(tags):
+        index[tag.tagName].extend(distribute(tag))
     # Show table cell insertions
-    tags = set()
-    for node in list(dom.getElementsByTagName('td') +
-                     dom.getElementsByTagName('th')):
+    tags = []
+    for node in index['td'] + index['th']:
         parent = node.parentNode
         if parent.tagName in ('ins', 'del'):
-            tags.add(parent)
-    for tag in tags:
-        distribute(tag)
+            tags.append(parent)
+    for tag in unique_nodes(tags):
+        index[tag.tagName].extend(distribute(tag))
     # All other ins and del tags inside a table but not in a cell are invalid,
-    # so remove them.
-    for node in list(dom.getElementsByTagName('ins') +
-                     dom.getElementsByTagName('del')):
+    # so remove them. The tags that were unwrapped above have no parent.
+    for node in index['ins'] + index['del']:
         parent = node.parentNode
-        if parent.tagName in ['table', 'tbody', 'thead', 'tfoot', 'tr']:
+        if parent is not None and parent.tagName in ['table', 'tbody', 'thead', 'tfoot', 'tr']:
             remove_node(node)
-
@@ -0,0 +1,121 @@
+"""
+Limits on the size and shape of the documents that diff() will work on.
+
+A very large document can keep a diff busy for a long time, and use a lot of
+memory. Pass DiffLimits to diff() to refuse such documents:
+
+>>> from htmltreediff import diff
+>>> limits = DiffLimits(max_siblings=3)
+>>> diff('<p>one</p>', '<p>one</p><p>two</p>', limits=limits)
+'<p>one</p><ins><p>two</p></ins>'
+>>> diff('<p>one</p>', '<p>1</p><p>2</p><p>3</p><p>4</p>', limits=limits)
+Traceback (most recent call last):
+...
+DiffTooLarge: max_siblings exceeded: 4 > 3
+
+Instead of raising DiffTooLarge, a limit can fall back to a plaintext diff of
+the text of the documents, or return a message saying that the differences
+are too large to show:
+
+>>> limits = DiffLimits(max_siblings=3, policy='plaintext')
+>>> diff('<p>one</p>', '<p>1</p><p>2</p><p>3</p><p>4</p>', limits=limits)
+'<del>one</del><ins>1 2 3 4</ins>'
+
+Each limit can have its own policy:
+
+>>> limits = DiffLimits(max_depth=2, max_tokens=100, policy='raise',
+...                     policies={'max_tokens': 'message'})
+>>> limits.policy_for('max_depth'), limits.policy_for('max_tokens')
+('raise', 'message')
+"""
+
+from xml.dom import Node
+
+limit_policies = ['raise', 'plaintext', 'message']
+
+class DiffTooLarge(Exception):
+    """A document is over one of the limits of the diff."""
+    def __init__(self, limit, value, maximum):
+        Exception.__init__(self, '%s exceeded: %d > %d' % (limit, value, maximum))
+        self.limit = limit
+        self.value = value
+        self.maximum = maximum
+
+class DiffLimits(object):
+    """
+    Limits on the documents given to diff(). A limit of None is not checked.
+
+    max_nodes: the number of nodes in the parsed document.
+    max_depth: how deeply the elements of the document are nested.
+    max_siblings: the number of children of any one node.
+    max_tokens: the number of pieces that the text is split into.
+
+    The policy says what happens when a document is over a limit: 'raise'
+    raises DiffTooLarge, 'plaintext' diffs the text of the documents instead,
+    and 'message' returns a message that the differences are too large to
+    show. The policies dictionary overrides the policy for single limits.
+    A plaintext diff has no tree to fall back from, so 'plaintext' acts like
+    'message' for plaintext diffs, and for max_tokens.
+    """
+    def __init__(self, max_nodes=None, max_depth=None, max_tokens=None,
+                 max_siblings=None, policy='raise', policies=None):
+        self.max_nodes = max_nodes
+        self.max_depth = max_depth
+        self.max_tokens = max_tokens
+        self.max_siblings = max_siblings
+        self.policy = policy
+        self.policies = policies or {}
+        for name in [policy] + self.policies.values():
+            if name not in limit_policies:
+                raise ValueError('Unknown limit policy: %r' % name)
+
+    def policy_for(self, limit):
+        return self.policies.get(limit, self.policy)
+
+    def check_dom(self, dom):
+        """Raise DiffTooLarge if the dom is over the node, depth or sibling limits."""
+        if self.max_nodes is None and self.max_depth is None and self.max_siblings is None:
+            return
+        nodes, depth, siblings = dom_shape(dom)
+        for limit, value in [
+            ('max_nodes', nodes),
+            ('max_depth', depth),
+            ('max_siblings', siblings),
+        ]:
+            maximum = getattr(self, limit)
+            if maximum is not None and value > maximum:
+                raise DiffTooLarge(limit, value, maximum)
+
+    def check_tokens(self, count):
+        if self.max_tokens is not None and count > self.max_tokens:
+            raise DiffTooLarge('max_tokens', count, self.max_tokens)
+
+def dom_shape(dom):
+    """
+    Return (nodes, depth, siblings) for the dom: the number of nodes, the
+    depth of the most deeply nested node, and the largest number of children
+    of any node. The document element has depth 1.
+
+    >>> from htmltreediff.util import parse_minidom
+    >>> dom_shape(parse_minidom('<p>one <em>two</em></p><p>three</p>'))
+    (7, 4, 2)
+    """
+    if dom.nodeType == Node.DOCUMENT_NODE:
+        dom = dom.documentElement
+    # Walk the tree with an explicit stack, since it can be deeper than the
+    # recursion limit.
+    nodes = 0
+    max_depth = 0
+    max_siblings = 0
+    stack = [(dom, 1)]
+    while stack:
+        node, depth = stack.pop()
+        nodes += 1
+        if depth > max_depth:
+            max_depth = depth
+        children = node.childNodes
+        if len(children) > max_siblings:
+            max_siblings = len(children)
+        for child in children:
+            stack.append((child, depth + 1))
+    return nodes, max_depth, max_siblings
@@ -0,0 +1,296 @@
+"""
+Run diffs in a bounded pool of worker processes or threads.
+
+Diffing is CPU bound, so a program that has to stay responsive, like a
+server or an event loop, should hand the work off to a pool instead of
+calling diff() inline.
+
+>>> pool = DiffPool(processes=2, threads=True)
+>>> task = pool.diff_async('<h1>one two</h1>', '<h1>one three</h1>')
+>>> print task.get()
+<h1>one <del>two</del><ins>three</ins></h1>
+>>> list(pool.diff_many([('a', 'a'), ('a', 'b')], plaintext=True))
+['a', '<del>a</del><ins>b</ins>']
+>>> pool.close()
+>>> pool.join()
+"""
+
+import os
+import cPickle as pickle
+import threading
+from collections import deque
+from multiprocessing import Pool, TimeoutError, cpu_count
+from multiprocessing.pool import ThreadPool
+from multiprocessing.sharedctypes import RawArray
+
+from htmltreediff.html import diff
+from htmltreediff.diff_core import DiffCancelled
+
+__all__ = ['DiffPool', 'DiffTask', 'DiffCancelled', 'WorkerDied', 'diff_many']
+
+class WorkerDied(Exception):
+    """The worker process running a task died before finishing it."""
+
+# Cancellation flags shared with the workers, one per pending task slot. They
+# are handed to the workers when the pool starts, because shared memory can't
+# be sent along with each task. The process ids of the workers running the
+# task in each slot are shared the same way.
+_cancel_flags = None
+_worker_pids = None
+
+def _init_worker(cancel_flags, worker_pids):
+    global _cancel_flags, _worker_pids
+    _cancel_flags = cancel_flags
+    _worker_pids = worker_pids
+
+class _SlotFlag(object):
+    """Check the cancellation flag of one task slot, like threading.Event."""
+    def __init__(self, slot):
+        self.slot = slot
+
+    def is_set(self):
+        return bool(_cancel_flags[self.slot])
+
+def _run(slot, call, pickled):
+    # Python 2 pools only call back when a task succeeds, so _run never
+    # raises, and the task slot is always released. Exceptions are returned
+    # instead. In a process pool, the call and the outcome are pickled here,
+    # so that pickling errors are returned too.
+    if _worker_pids is not None:
+        _worker_pids[slot] = os.getpid()
+    try:
+        try:
+            if pickled:
+                call = pickle.loads(call)
+            func, args, kwargs = call
+            outcome = True, func(cancel=_SlotFlag(slot), *args, **kwargs)
+        except BaseException, e:
+            outcome = False, e
+        if not pickled:
+            return outcome
+        try:
+            return pickle.dumps(outcome, pickle.HIGHEST_PROTOCOL)
+        except Exception, e:
+            error = pickle.PicklingError(
+                'Could not send back the outcome of the task: %s: %s' % (
+                    e.__class__.__name__, e))
+            return pickle.dumps((False, error), pickle.HIGHEST_PROTOCOL)
+    finally:
+        if _worker_pids is not None:
+            _worker_pids[slot] = 0
+
+class DiffTask(object):
+    """A diff that has been handed to a DiffPool."""
+    def __init__(self, pool, slot):
+        self._pool = pool
+        self._slot = slot
+        self._outcome = None
+        self._async_result = None
+        self._done = threading.Event()
+        self._finished = False
+
+    def ready(self):
+        return self._done.is_set()
+
+    def get(self, timeout=None):
+        """
+        Wait for the diff and return the result. Exceptions from the diff are
+        raised here, including DiffCancelled, and WorkerDied if the worker
+        process died.
+        """
+        if not self._done.wait(timeout):
+            raise TimeoutError()
+        ok, value = self._outcome
+        if not ok:
+            raise value
+        return value
+
+    def cancel(self):
+        """Stop the diff at its next checkpoint, if it is still running."""
+        with self._pool._slot_lock:
+            # Once finished, the slot may already belong to another task.
+            if not self._finished:
+                self._pool._cancel_flags[self._slot] = 1
+
+class DiffPool(object):
+    """
+    A pool of workers for running diffs.
+
+    At most max_pending tasks are queued or running at once, by default two
+    for each worker. Submitting more blocks until a slot frees up, which
+    pushes back on producers that are faster than the workers. Use
+    threads=True for a thread pool, which avoids pickling the documents, but
+    only helps when diffs can overlap with I/O.
+    """
+    # How often to check for tasks lost to workers that died, in seconds.
+    check_interval = 0.5
+
+    def __init__(self, processes=None, threads=False, max_pending=None):
+        if threads:
+            pool_class = ThreadPool
+            worker_pids = None
+        else:
+            pool_class = Pool
+        if max_pending is None:
+            max_pending = 2 * (processes or cpu_count())
+        self.max_pending = max_pending
+        self._threads = threads
+        self._cancel_flags = RawArray('b', max_pending)
+        if not threads:
+            worker_pids = RawArray('i', max_pending)
+        self._worker_pids = worker_pids
+        self._free_slots = range(max_pending)
+        self._tasks = {}
+        self._slot_lock = threading.Lock()
+        self._semaphore = threading.Semaphore(max_pending)
+        self._pool = pool_class(
+            processes,
+            initializer=_init_worker,
+            initargs=(self._cancel_flags, worker_pids),
+        )
+        self._closed = threading.Event()
+        self._watcher = None
+        if not threads:
+            self._watcher = threading.Thread(target=self._watch_workers)
+            self._watcher.daemon = True
+            self._watcher.start()
+
+    def _take_slot(self):
+        self._semaphore.acquire()
+        with self._slot_lock:
+            slot = self._free_slots.pop()
+        self._cancel_flags[slot] = 0
+        if self._worker_pids is not None:
+            self._worker_pids[slot] = 0
+        return slot
+
+    def _release_slot(self, slot):
+        with self._slot_lock:
+            self._free_slots.append(slot)
+        self._semaphore.release()
+
+    def _finish(self, task, outcome):
+        with self._slot_lock:
+            if task._finished:
+                return
+            task._finished = True
+            task._outcome = outcome
+            del self._tasks[task._slot]
+            self._free_slots.append(task._slot)
+        self._semaphore.release()
+        task._done.set()
+
+    def _watch_workers(self):
+        # A task whose worker process dies never calls back, so find those
+        # tasks, and finish them with WorkerDied.
+        while not self._closed.wait(self.check_interval):
+            alive = set(p.pid for p in self._pool._pool if p.exitcode is None)
+            with self._slot_lock:
+                running = [(task, self._worker_pids[slot])
+                           for slot, task in self._tasks.items()]
+            for task, pid in running:
+                if pid and pid not in alive:
+                    error = WorkerDied(
+                        'The worker process %d died while running the task.' % pid)
+                    self._finish(task, (False, error))
+                    # Take the lost task off the pool's books too, or joining
+                    # the pool waits for it forever.
+                    task._async_result._set(None, (False, error))
+
+    def _on_result(self, task, result):
+        if self._threads:
+            self._finish(task, result)
+        else:
+            self._finish(task, pickle.loads(result))
+
+    def submit(self, func, *args, **kwargs):
+        """
+        Run func(*args, **kwargs) in the pool, and return a DiffTask for it.
+
+        The function must be picklable, and must accept a cancel keyword
+        argument, which it should pass along to diff().
+        """
+        slot = self._take_slot()
+        call = (func, args, kwargs)
+        try:
+            if not self._threads:
+                call = pickle.dumps(call, pickle.HIGHEST_PROTOCOL)
+        except BaseException:
+            self._release_slot(slot)
+            raise
+        task = DiffTask(self, slot)
+        with self._slot_lock:
+            self._tasks[slot] = task
+        task._async_result = self._pool.apply_async(
+            _run,
+            (slot, call, not self._threads),
+            callback=lambda result: self._on_result(task, result),
+        )
+        return task
+
+    def diff_async(self, old_html, new_html, **kwargs):
+        """Start a diff in the pool, and return a DiffTask for it."""
+        return self.submit(diff, old_html, new_html, **kwargs)
+
+    def diff_many(self, pairs, **kwargs):
+        """
+        Diff each (old_html, new_html) pair, yielding results in order.
+
+        Pairs are only read from the iterable as slots free up, so it can be a
+        lazy stream. If the consumer stops early, the remaining diffs are
+        cancelled.
+        """
+        return self.imap(diff, pairs, **kwargs)
+
+    def imap(self, func, arg_tuples, **kwargs):
+        """
+        Run func(*args, **kwargs) for each tuple of args, yielding results in
+        order, with the same bounds as diff_many().
+        """
+        tasks = deque()
+        try:
+            for args in arg_tuples:
+                if len(tasks) >= self.max_pending:
+                    yield tasks.popleft().get()
+                tasks.append(self.submit(func, *args, **kwargs))
+            while tasks:
+                yield tasks.popleft().get()
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def close(self):
+        self._pool.close()
+
+    def join(self):
+        self._pool.join()
+        self._stop_watcher()
+
+    def terminate(self):
+        self._stop_watcher()
+        self._pool.terminate()
+
+    def _stop_watcher(self):
+        self._closed.set()
+        if self._watcher is not None:
+            self._watcher.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        self.join()
+
+def diff_many(pairs, processes=None, threads=False, max_pending=None, **kwargs):
+    """
+    Diff each (old_html, new_html) pair in a pool of workers, yielding the
+    results in order. Keyword arguments are passed on to diff().
+    """
+    pool = DiffPool(processes, threads=threads, max_pending=max_pending)
+    try:
+        for result in pool.diff_many(pairs, **kwargs):
+            yield result
+    finally:
+        pool.terminate()
+        pool.join()
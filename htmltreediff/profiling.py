@@ -0,0 +1,104 @@
+"""
+Profile diffs, for finding out why a document is slow to diff.
+
+Profiles can be written in the pstats format of cProfile, or as collapsed
+stacks, one line per stack with the time spent in it, which flamegraph tools
+read directly:
+
+    diff (htmltreediff/html.py:11);_diff (htmltreediff/html.py:31) 1234
+
+The times in collapsed stacks are in microseconds.
+"""
+
+import os
+import sys
+import time
+import cProfile
+
+def profile_call(pstats_path, func, *args, **kwargs):
+    """Call the function under cProfile, and write the stats to a file."""
+    profiler = cProfile.Profile()
+    try:
+        return profiler.runcall(func, *args, **kwargs)
+    finally:
+        profiler.dump_stats(pstats_path)
+
+def _frame_label(frame):
+    code = frame.f_code
+    return '%s (%s:%d)' % (code.co_name, _short_path(code.co_filename), code.co_firstlineno)
+
+def _short_path(path):
+    # Show paths inside the package relative to it, and others as the bare
+    # file name.
+    package_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    path = os.path.abspath(path)
+    if path.startswith(package_dir + os.sep):
+        return path[len(package_dir) + 1:]
+    return os.path.basename(path)
+
+def _builtin_label(func):
+    module = getattr(func, '__module__', None)
+    if module:
+        return '%s.%s' % (module, func.__name__)
+    return func.__name__
+
+class StackProfiler(object):
+    """
+    Record the time spent in each distinct call stack, by tracing every call
+    and return. This is slower than cProfile, but keeps whole stacks, which
+    cProfile doesn't.
+    """
+    def __init__(self):
+        self.stack_times = {}
+        self._stack = []
+        self._last_time = None
+
+    def _trace(self, frame, event, arg):
+        now = time.time()
+        if self._stack:
+            key = tuple(self._stack)
+            self.stack_times[key] = self.stack_times.get(key, 0.0) + (now - self._last_time)
+        if event == 'call':
+            self._stack.append(_frame_label(frame))
+        elif event == 'c_call':
+            self._stack.append(_builtin_label(arg))
+        elif event in ('return', 'c_return', 'c_exception'):
+            if self._stack:
+                self._stack.pop()
+        self._last_time = time.time()
+
+    def runcall(self, func, *args, **kwargs):
+        self._last_time = time.time()
+        sys.setprofile(self._trace)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            sys.setprofile(None)
+
+    def collapsed_lines(self):
+        """Yield lines in the collapsed stack format, sorted by stack."""
+        for stack, seconds in sorted(self.stack_times.items()):
+            microseconds = int(round(seconds * 1000000))
+            if microseconds > 0:
+                yield '%s %d' % (';'.join(stack), microseconds)
+
+    def write_collapsed(self, path):
+        with open(path, 'w') as f:
+            for line in self.collapsed_lines():
+                f.write(line + '\n')
+
+def time_repeats(repeat, func, *args, **kwargs):
+    """Call the function repeatedly, and return the list of wall clock times."""
+    times = []
+    for _ in range(repeat):
+        start = time.time()
+        func(*args, **kwargs)
+        times.append(time.time() - start)
+    return times
+
+def median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2.0
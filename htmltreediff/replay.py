@@ -0,0 +1,84 @@
+"""
+Replay diffs saved by htmltreediff.capture, to reproduce and profile them.
+
+    $ htmltreediff replay /var/tmp/slow-diffs --profile profiles/
+
+Each capture is diffed again, and its time and work counters are compared
+with the ones it was captured with.
+"""
+
+import os
+import argparse
+
+from htmltreediff import __version__
+from htmltreediff.html import diff
+from htmltreediff.capture import load_case
+from htmltreediff.benchmark import measure
+
+def capture_paths(paths):
+    """Yield the capture files, given files or capture directories."""
+    for path in paths:
+        if os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                if name.endswith('.json'):
+                    yield os.path.join(path, name)
+        else:
+            yield path
+
+def replay_case(case, repeat=3):
+    """
+    Diff the captured case again, and return a dictionary with the work
+    counters, and the best wall clock time.
+    """
+    return measure(case['old'], case['new'], case['options'], repeat=repeat)
+
+def profile_case(case, name, profile_dir=None, collapsed_dir=None):
+    from htmltreediff.profiling import profile_call, StackProfiler
+    if profile_dir:
+        path = os.path.join(profile_dir, name + '.pstats')
+        profile_call(path, diff, case['old'], case['new'], **case['options'])
+    if collapsed_dir:
+        profiler = StackProfiler()
+        profiler.runcall(diff, case['old'], case['new'], **case['options'])
+        profiler.write_collapsed(os.path.join(collapsed_dir, name + '.collapsed'))
+
+def report_case(name, case, result):
+    lines = ['%s: captured %.1f ms (version %s), replayed %.1f ms (version %s)' % (
+        name,
+        case['seconds'] * 1000,
+        case['version'],
+        result['seconds'] * 1000,
+        __version__,
+    )]
+    captured_counters = case['stats']['counters']
+    for counter, count in sorted(result['counters'].items()):
+        captured_count = captured_counters.get(counter)
+        if captured_count != count:
+            lines.append('    %s: %s captured, %s replayed' % (counter, captured_count, count))
+    return '\n'.join(lines)
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+        prog='htmltreediff replay',
+        description='Replay captured slow diffs.',
+    )
+    parser.add_argument('paths', nargs='+', metavar='PATH',
+                        help='capture file, or directory of capture files')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='run each diff N times, and report the best time')
+    parser.add_argument('--profile', metavar='DIR',
+                        help='write cProfile stats for each capture to DIR')
+    parser.add_argument('--collapsed', metavar='DIR',
+                        help='write collapsed stacks for each capture to DIR')
+    args = parser.parse_args(argv)
+
+    for profile_dir in [args.profile, args.collapsed]:
+        if profile_dir and not os.path.isdir(profile_dir):
+            os.makedirs(profile_dir)
+    for path in capture_paths(args.paths):
+        name = os.path.splitext(os.path.basename(path))[0]
+        case = load_case(path)
+        result = replay_case(case, repeat=args.repeat)
+        print report_case(name, case, result)
+        profile_case(case, name, args.profile, args.collapsed)
+    return 0
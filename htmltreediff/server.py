@@ -0,0 +1,227 @@
+"""
+A resident diff server on a Unix socket, and a client for it.
+
+Starting a new interpreter and importing the parsers costs more than most
+diffs, so tools that diff many documents one at a time can start a server
+once, and send it their diffs instead.
+
+The protocol is JSON lines. Each request is a single line holding an object
+with the keys "old" and "new", and optionally "options", with keyword
+arguments for diff(). Each response is a single line holding an object with
+either a "diff" key, or an "error" key. A connection may send any number of
+requests, one after the other.
+
+The socket can only be used by the user that runs the server. Clients check
+that the socket belongs to them before sending it any documents.
+"""
+
+import os
+import sys
+import json
+import stat
+import errno
+import socket
+import argparse
+import tempfile
+import SocketServer
+
+# Keyword arguments of diff() that clients are allowed to set.
+_allowed_options = ['cutoff', 'plaintext', 'pretty']
+
+def default_socket_path():
+    """
+    Return $HTMLTREEDIFF_SOCKET, or else a socket in $XDG_RUNTIME_DIR, or
+    else a socket in a directory of the user's own in the temp directory.
+    """
+    if os.environ.get('HTMLTREEDIFF_SOCKET'):
+        return os.environ['HTMLTREEDIFF_SOCKET']
+    if os.environ.get('XDG_RUNTIME_DIR'):
+        return os.path.join(os.environ['XDG_RUNTIME_DIR'], 'htmltreediff.sock')
+    return os.path.join(
+        tempfile.gettempdir(), 'htmltreediff-%d' % os.getuid(), 'diff.sock')
+
+class ServerError(Exception):
+    """The diff server reported an error for a request."""
+
+class _RequestHandler(SocketServer.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            response = self.server.handle_request_line(line)
+            self.wfile.write(json.dumps(response) + '\n')
+            self.wfile.flush()
+
+class DiffServer(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+    """
+    Serve diffs on a Unix socket, using a pool of worker processes.
+
+    Everything the diff needs is imported and warmed up before the workers
+    are forked, so the workers start out ready.
+    """
+    daemon_threads = True
+
+    def __init__(self, socket_path, workers=None, threads=False):
+        from htmltreediff.html import diff
+        from htmltreediff.parallel import DiffPool
+        diff('<p>warm up</p>', '<p>warm up the parser</p>')
+        _make_socket_dir(os.path.dirname(socket_path))
+        _remove_stale_socket(socket_path)
+        self.socket_path = socket_path
+        self.pool = DiffPool(workers, threads=threads)
+        # Other users can't connect to the socket, not even between binding
+        # it and changing its mode.
+        old_umask = os.umask(0177)
+        try:
+            SocketServer.UnixStreamServer.__init__(self, socket_path, _RequestHandler)
+        finally:
+            os.umask(old_umask)
+        os.chmod(socket_path, 0600)
+
+    def handle_request_line(self, line):
+        try:
+            request = json.loads(line)
+            options = request.get('options') or {}
+            for key in options:
+                if key not in _allowed_options:
+                    raise ValueError('Unknown option: %s' % key)
+            options = dict((str(k), v) for k, v in options.items())
+            task = self.pool.diff_async(request['old'], request['new'], **options)
+            return {'diff': task.get()}
+        except Exception, e:
+            return {'error': '%s: %s' % (e.__class__.__name__, e)}
+
+    def server_close(self):
+        SocketServer.UnixStreamServer.server_close(self)
+        self.pool.terminate()
+        self.pool.join()
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+
+def _make_socket_dir(path):
+    """
+    Make the directory for the socket, readable only by the user, if it
+    doesn't exist. If it does, it must not belong to another user.
+    """
+    if not path:
+        return
+    try:
+        os.makedirs(path, 0700)
+    except OSError, e:
+        if e.errno != errno.EEXIST:
+            raise
+        owner = os.stat(path).st_uid
+        if owner not in (os.getuid(), 0):
+            raise ServerError('%s belongs to another user' % path)
+
+def check_socket_owner(socket_path):
+    """
+    Raise ServerError if the socket belongs to another user, who could read
+    the documents sent to it, and send back anything.
+    """
+    if os.stat(socket_path).st_uid != os.getuid():
+        raise ServerError('%s belongs to another user' % socket_path)
+
+def _remove_stale_socket(socket_path):
+    """Remove a socket file left behind by a server that is gone."""
+    if not os.path.exists(socket_path):
+        return
+    if server_running(socket_path):
+        raise ServerError('A server is already running on %s' % socket_path)
+    os.remove(socket_path)
+
+def server_running(socket_path):
+    try:
+        connect(socket_path).close()
+    except socket.error:
+        return False
+    return True
+
+def connect(socket_path):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path)
+    except socket.error:
+        sock.close()
+        raise
+    return sock
+
+class DiffClient(object):
+    """A connection to a diff server, which can send any number of diffs."""
+    def __init__(self, socket_path=None):
+        if socket_path is None:
+            socket_path = default_socket_path()
+        check_socket_owner(socket_path)
+        self.sock = connect(socket_path)
+        self.file = self.sock.makefile('rwb')
+
+    def diff(self, old_html, new_html, **options):
+        request = {'old': old_html, 'new': new_html, 'options': options}
+        self.file.write(json.dumps(request) + '\n')
+        self.file.flush()
+        line = self.file.readline()
+        if not line:
+            raise ServerError('The server closed the connection')
+        response = json.loads(line)
+        if 'error' in response:
+            raise ServerError(response['error'])
+        return response['diff']
+
+    def close(self):
+        self.file.close()
+        self.sock.close()
+
+def try_server_diff(old_html, new_html, socket_path=None, **options):
+    """
+    Send the diff to a running server. Return None if there is no server
+    running, or the socket belongs to another user, so the caller can do the
+    diff itself.
+    """
+    if socket_path is None:
+        socket_path = default_socket_path()
+    try:
+        socket_stat = os.stat(socket_path)
+    except OSError:
+        return None
+    if not stat.S_ISSOCK(socket_stat.st_mode) or socket_stat.st_uid != os.getuid():
+        return None
+    try:
+        client = DiffClient(socket_path)
+    except socket.error, e:
+        if e.errno in (errno.ECONNREFUSED, errno.ENOENT):
+            return None
+        raise
+    try:
+        return client.diff(old_html, new_html, **options)
+    finally:
+        client.close()
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+        prog='htmltreediff serve',
+        description='Serve diffs on a Unix socket, with warm worker processes.',
+    )
+    parser.add_argument('--socket', default=default_socket_path(),
+                        help='socket path (default: $HTMLTREEDIFF_SOCKET or %(default)s)')
+    parser.add_argument('-j', '--workers', type=int, default=None,
+                        help='number of worker processes (default: one per cpu)')
+    parser.add_argument('--capture-dir', metavar='DIR',
+                        help='save the inputs of slow diffs to DIR, for htmltreediff replay')
+    parser.add_argument('--capture-threshold', type=float, default=1.0, metavar='SECONDS',
+                        help='capture diffs slower than this (default: %(default)s)')
+    args = parser.parse_args(argv)
+
+    if args.capture_dir:
+        # Enabled before the workers are forked, so that they capture too.
+        from htmltreediff.capture import enable_capture
+        enable_capture(args.capture_dir, threshold=args.capture_threshold)
+
+    server = DiffServer(args.socket, workers=args.workers)
+    sys.stderr.write('Serving diffs on %s\n' % args.socket)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
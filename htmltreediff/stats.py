@@ -0,0 +1,284 @@
+"""
+Statistics about where a diff spends its time.
+
+Pass a DiffStats object to diff() to collect them:
+
+>>> from htmltreediff import diff
+>>> stats = DiffStats()
+>>> changes = diff('<h1>one</h1>', '<h1>two</h1>', stats=stats)
+>>> [name for name, wall, cpu in stats.phases] # doctest: +NORMALIZE_WHITESPACE
+['parse', 'split_text_nodes', 'similarity', 'differ', 'changes_markup',
+ 'tag_index', 'fix_lists', 'fix_tables', 'tostring']
+>>> sorted(stats.sizes.items()) # doctest: +NORMALIZE_WHITESPACE
+[('new_html', 12), ('new_nodes', 3), ('old_html', 12), ('old_nodes', 3),
+ ('output', 46)]
+
+Counts of the work done are collected too. Unlike the timings, they are
+exactly the same from run to run.
+
+>>> sorted(stats.counters.items()) # doctest: +NORMALIZE_WHITESPACE
+[('compared_nodes', 8), ('delete_ops', 1), ('diff_location_calls', 1),
+ ('fuzzy_comparisons', 2), ('insert_ops', 1), ('sequence_matchers', 4),
+ ('tree_hashes', 8), ('walked_nodes', 23)]
+"""
+
+import os
+import time
+import threading
+
+class _NullContext(object):
+    def __enter__(self):
+        pass
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+_null_context = _NullContext()
+
+class NullStats(object):
+    """Stand-in used when no statistics are wanted. It does nothing."""
+    def phase(self, name):
+        return _null_context
+
+    def activate(self):
+        return _null_context
+
+    def count(self, name, n=1):
+        pass
+
+    def record_size(self, name, size):
+        pass
+
+    def record_dom_size(self, name, dom):
+        pass
+
+null_stats = NullStats()
+
+# Counts are made deep inside the diff algorithm, so rather than passing the
+# stats object everywhere, the stats object for the diff in progress is kept
+# per thread.
+_local = threading.local()
+
+def active_stats():
+    """Return the stats object that counts work in the current thread."""
+    return getattr(_local, 'stats', null_stats)
+
+class _Activation(object):
+    def __init__(self, stats):
+        self.stats = stats
+
+    def __enter__(self):
+        self.previous = active_stats()
+        _local.stats = self.stats
+        if self.stats.memory_tracker:
+            self.stats.memory_tracker.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        _local.stats = self.previous
+        if self.stats.memory_tracker:
+            self.stats.top_allocations = self.stats.memory_tracker.stop()
+
+class _PhaseTimer(object):
+    def __init__(self, stats, name):
+        self.stats = stats
+        self.name = name
+
+    def __enter__(self):
+        self.wall_start = time.time()
+        self.cpu_start = time.clock()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stats.record_phase(
+            self.name,
+            time.time() - self.wall_start,
+            time.clock() - self.cpu_start,
+        )
+
+class MemoryTracker(object):
+    """
+    Measure memory use at the end of each phase of a diff.
+
+    When tracemalloc is available, it measures the memory allocated by python,
+    and finds the lines that allocated the most. Otherwise, the resident size
+    of the process is measured instead, as the change since the diff started,
+    and the peak is the highest of those measurements, so it misses memory
+    that was freed again within a phase. The lines that allocated the most
+    can only be found with tracemalloc.
+    """
+    def __init__(self, top=10):
+        try:
+            import tracemalloc
+        except ImportError:
+            tracemalloc = None
+        self.tracemalloc = tracemalloc
+        self.top = top
+        self._started_tracing = False
+        self._largest_snapshot = None
+        self._largest_size = -1
+        self._start_size = None
+        self._peak_size = None
+
+    def start(self):
+        if self.tracemalloc and not self.tracemalloc.is_tracing():
+            self.tracemalloc.start()
+            self._started_tracing = True
+        self._start_size = _process_size()
+        self._peak_size = None
+
+    def measure(self):
+        """Return (current_bytes, peak_bytes). Either may be None if unknown."""
+        if self.tracemalloc and self.tracemalloc.is_tracing():
+            current, peak = self.tracemalloc.get_traced_memory()
+            if current > self._largest_size:
+                self._largest_size = current
+                self._largest_snapshot = self.tracemalloc.take_snapshot()
+            return current, peak
+        size = _process_size()
+        if size is None or self._start_size is None:
+            return None, None
+        current = size - self._start_size
+        if self._peak_size is None or current > self._peak_size:
+            self._peak_size = current
+        return current, self._peak_size
+
+    def stop(self):
+        """
+        Stop tracing, and return the lines that allocated the most memory
+        that was still in use when memory use was highest, as a list of
+        tuples, (site, size_bytes, count).
+        """
+        top_allocations = []
+        if self._largest_snapshot is not None:
+            statistics = self._largest_snapshot.statistics('lineno')
+            for statistic in statistics[:self.top]:
+                frame = statistic.traceback[0]
+                site = '%s:%d' % (frame.filename, frame.lineno)
+                top_allocations.append((site, statistic.size, statistic.count))
+        if self._started_tracing:
+            self.tracemalloc.stop()
+            self._started_tracing = False
+        return top_allocations
+
+def _process_size():
+    try:
+        with open('/proc/self/statm') as statm:
+            pages = int(statm.read().split()[1])
+    except (IOError, OSError, ValueError, IndexError):
+        return None
+    return pages * os.sysconf('SC_PAGE_SIZE')
+
+class DiffStats(object):
+    """
+    Collect the wall clock and cpu time of each phase of a diff, and the sizes
+    of the input and output.
+
+    If a callback is given, it is called as callback(name, wall, cpu) at the
+    end of each phase, for feeding the timings into a metrics system.
+
+    If memory is true, memory use is also measured at the end of each phase.
+    This is slow, especially with tracemalloc, so leave it off in production.
+    """
+    def __init__(self, callback=None, memory=False):
+        self.callback = callback
+        self.phases = [] # List of tuples, (name, wall_seconds, cpu_seconds)
+        self.sizes = {}
+        self.counters = {}
+        self.memory_tracker = None
+        if memory:
+            self.memory_tracker = MemoryTracker()
+        self.memory = [] # List of tuples, (name, current_bytes, peak_bytes)
+        self.top_allocations = [] # List of tuples, (site, size_bytes, count)
+
+    def phase(self, name):
+        """Return a context manager that times a phase of the diff."""
+        return _PhaseTimer(self, name)
+
+    def record_phase(self, name, wall, cpu):
+        self.phases.append((name, wall, cpu))
+        if self.memory_tracker:
+            current, peak = self.memory_tracker.measure()
+            self.memory.append((name, current, peak))
+        if self.callback:
+            self.callback(name, wall, cpu)
+
+    def activate(self):
+        """
+        Return a context manager, which makes this the stats object that
+        counts work in the current thread.
+        """
+        return _Activation(self)
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def record_size(self, name, size):
+        self.sizes[name] = size
+
+    def record_dom_size(self, name, dom):
+        """Record the number of nodes in the dom, below the document."""
+        # Don't use walk_dom, so that this isn't counted as diff work.
+        size = 0
+        stack = [dom.documentElement]
+        while stack:
+            node = stack.pop()
+            size += 1
+            stack.extend(node.childNodes)
+        self.sizes[name] = size
+
+    def comparisons_per_node(self):
+        """
+        Return the number of fuzzy tree comparisons made per input node. If
+        this grows with the size of the input, the diff is going quadratic.
+        """
+        nodes = self.sizes.get('old_nodes', 0) + self.sizes.get('new_nodes', 0)
+        if not nodes:
+            return 0.0
+        return float(self.counters.get('fuzzy_comparisons', 0)) / nodes
+
+    def phase_totals(self):
+        """Return a dictionary of name: (wall_seconds, cpu_seconds)."""
+        totals = {}
+        for name, wall, cpu in self.phases:
+            total_wall, total_cpu = totals.get(name, (0.0, 0.0))
+            totals[name] = (total_wall + wall, total_cpu + cpu)
+        return totals
+
+    def as_dict(self):
+        """Return the statistics as a dictionary that can be saved as JSON."""
+        return {
+            'phases': [list(phase) for phase in self.phases],
+            'sizes': dict(self.sizes),
+            'counters': dict(self.counters),
+            'memory': [list(memory) for memory in self.memory],
+            'top_allocations': [list(site) for site in self.top_allocations],
+        }
+
+    def report(self):
+        """Return a human-readable table of the statistics."""
+        lines = ['%-20s %10s %10s' % ('phase', 'wall ms', 'cpu ms')]
+        totals = self.phase_totals()
+        names = []
+        for name, wall, cpu in self.phases:
+            if name not in names:
+                names.append(name)
+        for name in names:
+            wall, cpu = totals[name]
+            lines.append('%-20s %10.2f %10.2f' % (name, wall * 1000, cpu * 1000))
+        for name, size in sorted(self.sizes.items()):
+            lines.append('%-20s %10d' % (name, size))
+        for name, count in sorted(self.counters.items()):
+            lines.append('%-20s %10d' % (name, count))
+        if self.memory:
+            lines.append('%-20s %10s %10s' % ('memory', 'current kb', 'peak kb'))
+            for name, current, peak in self.memory:
+                lines.append('%-20s %10s %10s' % (name, _kilobytes(current), _kilobytes(peak)))
+        if self.top_allocations:
+            lines.append('%-50s %10s %10s' % ('allocated at', 'kb', 'blocks'))
+            for site, size, count in self.top_allocations:
+                lines.append('%-50s %10s %10d' % (site, _kilobytes(size), count))
+        return '\n'.join(lines)
+
+def _kilobytes(size):
+    if size is None:
+        return '?'
+    return '%d' % (size // 1024)
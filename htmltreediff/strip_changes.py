@@ -0,0 +1,178 @@
+"""
+Get the old or the new version of a document back from its diff, without
+parsing it.
+
+>>> changes = '<p>one <del>two</del><ins>three</ins></p>'
+>>> strip_changes(changes, 'old')
+'<p>one two</p>'
+>>> strip_changes(changes, 'new')
+'<p>one three</p>'
+
+The list items that fix_lists() marks as deleted are handled too:
+
+>>> changes = '<ol><li>one</li><li class="del-li"><del>two</del></li></ol>'
+>>> strip_changes(changes, 'old')
+'<ol><li>one</li><li>two</li></ol>'
+>>> strip_changes(changes, 'new')
+'<ol><li>one</li></ol>'
+
+The html is read as a stream of tags and text. The tags are not matched up,
+only the depth inside a removed element is counted, so this takes linear
+time, and the memory used doesn't grow with the document. The input can be
+given in chunks, like the lines of a file, with iter_strip_changes().
+"""
+
+import re
+
+# The tags that are removed with their contents, and the tags that are
+# removed leaving their contents, for each version.
+_remove_tags = {'old': 'ins', 'new': 'del'}
+_unwrap_tags = {'old': 'del', 'new': 'ins'}
+
+_void_tags = set([
+    'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link',
+    'meta', 'param', 'source', 'track', 'wbr',
+])
+
+_tag_re = re.compile(r'''
+    <!--.*?-->
+    | <!\[CDATA\[.*?\]\]>
+    | <[!?][^>]*>
+    | <(/?)([A-Za-z][^\s/>]*)((?:[^>"']|"[^"]*"|'[^']*')*)>
+''', re.VERBOSE | re.DOTALL)
+
+# The start of a token that may be completed by the next chunk.
+_token_start_re = re.compile(r'<(?:[/!?]|[A-Za-z])')
+
+_del_li_class_re = re.compile(
+    r'''\s+class\s*=\s*(?:"del-li"|'del-li'|del-li(?=[\s/]|$))''')
+
+def strip_changes(html, version):
+    """
+    Return the old or the new version of the diff html, for version 'old' or
+    'new'.
+    """
+    return ''.join(iter_strip_changes([html], version))
+
+def iter_strip_changes(chunks, version):
+    """
+    Read the diff html from the iterable of chunks, and yield the pieces of
+    the old or the new version of it.
+    """
+    if version not in _remove_tags:
+        raise ValueError('Unknown version: %r' % version)
+    remove_tag = _remove_tags[version]
+    unwrap_tag = _unwrap_tags[version]
+    # The number of open elements inside the element being removed, or 0.
+    remove_depth = 0
+
+    buffer = ''
+    # While the buffer starts with a token that ends in a later chunk, like
+    # a long comment, the chunks are kept in a list, and only the new ones
+    # are searched for the end of the token, so that the buffer isn't
+    # scanned again for each chunk. A '>' may be quoted inside a tag, so a
+    # tag is only scanned again once the buffer has doubled in size too.
+    waiting = None
+    wait_for = None
+    waiting_size = rescan_size = 0
+    tail = ''
+    found = False
+    chunks = iter(chunks)
+    while True:
+        chunk = next(chunks, None)
+        at_end = chunk is None
+        if waiting is not None:
+            if not at_end:
+                waiting.append(chunk)
+                waiting_size += len(chunk)
+                # The end may start in the chunks before.
+                text = tail + chunk
+                tail = text[max(len(text) - len(wait_for) + 1, 0):]
+                found = found or wait_for in text
+                if not (found and waiting_size >= rescan_size):
+                    continue
+            buffer = ''.join(waiting)
+            waiting = None
+        elif not at_end:
+            buffer += chunk
+        pos = 0
+        while pos < len(buffer):
+            start = buffer.find('<', pos)
+            if start == -1:
+                start = len(buffer)
+            if start > pos:
+                if not remove_depth:
+                    yield buffer[pos:start]
+                pos = start
+                continue
+            match = _tag_re.match(buffer, start)
+            if (match and match.group(0).startswith('<!') and
+                    not at_end and _is_unclosed(buffer, start)):
+                # A comment or CDATA section that ends in a later chunk.
+                match = None
+            if match is None:
+                if not at_end and (start == len(buffer) - 1 or
+                                   _token_start_re.match(buffer, start)):
+                    # Wait for the rest of the tag.
+                    if start < len(buffer) - 1:
+                        wait_for = _token_end(buffer, start)
+                        waiting = [buffer[start:]]
+                        waiting_size = len(buffer) - start
+                        rescan_size = 0
+                        if wait_for == '>':
+                            rescan_size = 2 * waiting_size
+                        tail = buffer[len(buffer) - len(wait_for) + 1:]
+                        found = False
+                        pos = len(buffer)
+                    break
+                # A stray '<' is text.
+                if not remove_depth:
+                    yield '<'
+                pos = start + 1
+                continue
+            pos = match.end()
+
+            is_end_tag, tag_name, attributes = match.groups()
+            if tag_name is None:
+                # A comment, CDATA section, doctype or processing instruction.
+                if not remove_depth:
+                    yield match.group(0)
+                continue
+            tag_name = tag_name.lower()
+            is_empty = attributes.endswith('/') or tag_name in _void_tags
+            if remove_depth:
+                if is_end_tag:
+                    if tag_name not in _void_tags:
+                        remove_depth -= 1
+                elif not is_empty:
+                    remove_depth += 1
+            elif tag_name == unwrap_tag:
+                pass
+            elif tag_name == remove_tag:
+                if not is_end_tag and not is_empty:
+                    remove_depth = 1
+            elif tag_name == 'li' and not is_end_tag and _del_li_class_re.search(attributes):
+                if version == 'new':
+                    if not is_empty:
+                        remove_depth = 1
+                else:
+                    yield '<li%s>' % _del_li_class_re.sub('', attributes)
+            else:
+                yield match.group(0)
+        buffer = buffer[pos:]
+        if at_end:
+            break
+
+def _token_end(buffer, start):
+    if buffer.startswith('<!--', start):
+        return '-->'
+    if buffer.startswith('<![CDATA[', start):
+        return ']]>'
+    return '>'
+
+def _is_unclosed(buffer, start):
+    if buffer.startswith('<!--', start):
+        return buffer.find('-->', start + 4) == -1
+    if buffer.startswith('<![CDATA[', start):
+        return buffer.find(']]>', start + 9) == -1
+    return False
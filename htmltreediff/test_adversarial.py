@@ -0,0 +1,36 @@
+from htmltreediff.adversarial import measure_growth, measure_deep_growth
+
+def check_growth(shape, sizes, bound, edit=True, counter=None):
+    exponent, costs = measure_growth(shape, sizes, edit=edit, counter=counter)
+    assert exponent < bound, (
+        '%s (edit=%s) grows like size ** %.2f, costs %s' % (shape, edit, exponent, costs))
+
+def check_deep_growth(depths, bound, edit, counter):
+    exponent, costs = measure_deep_growth(depths, edit=edit, counter=counter)
+    assert exponent < bound, (
+        'deep dom (edit=%s) grows like depth ** %.2f, costs %s' % (edit, exponent, costs))
+
+# Count the work instead of timing it, so that the bounds can be tight, and
+# the tests don't fail on a busy machine.
+
+def test_identical_documents():
+    # Diffing identical documents should take linear time, up to the sizes
+    # that have caused trouble in practice.
+    for shape, sizes, counter in [
+        ('wide siblings', [2500, 10000], 'walked_nodes'),
+        ('near duplicate paragraphs', [250, 1000], 'walked_nodes'),
+        # Up to about 1 MB of text.
+        ('large text', [10000, 100000], 'compared_nodes'),
+    ]:
+        yield check_growth, shape, sizes, 1.1, False, counter
+    yield check_deep_growth, [500, 2000], 1.1, False, 'compared_nodes'
+
+def test_edited_documents():
+    for shape, sizes, counter, bound in [
+        ('wide siblings', [100, 200, 400], 'tree_hashes', 1.2),
+        ('near duplicate paragraphs', [25, 50, 100], 'fuzzy_comparisons', 1.2),
+        ('near duplicate paragraphs', [25, 50, 100], 'sequence_matchers', 1.2),
+        # Each level of the tree hashes all of the levels below it again.
+        ('deep nesting', [25, 50, 100], 'tree_hashes', 2.2),
+    ]:
+        yield check_growth, shape, sizes, bound, True, counter
@@ -0,0 +1,20 @@
+from htmltreediff.benchmark import imported_modules, check_baseline
+
+def test_lazy_imports():
+    # Importing the package doesn't load any of the parsers.
+    modules = imported_modules('import htmltreediff')
+    assert 'htmltreediff.html' in modules
+    for name in ['lxml', 'lxml.etree', 'lxml.sax', 'html5lib', 'xml.dom.pulldom']:
+        assert name not in modules, name
+    # They get loaded when they are needed.
+    modules = imported_modules(
+        'from htmltreediff.util import parse_minidom; parse_minidom("<p/>")')
+    assert 'lxml.etree' in modules
+
+def test_no_regressions():
+    # Fail if any corpus entry does more work than in the recorded baseline.
+    # If the extra work is intended, record a new baseline with:
+    #     python -m htmltreediff.benchmark --record-baseline
+    regressions = check_baseline(repeat=1)
+    assert not regressions, '\n'.join(
+        '%s: %s went from %s to %s' % regression for regression in regressions)
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+import shutil
+import tempfile
+from StringIO import StringIO
+
+from nose.tools import assert_equal
+
+from htmltreediff import __version__
+from htmltreediff.html import diff
+from htmltreediff.capture import (
+    SlowDiffCapture,
+    enable_capture,
+    disable_capture,
+    encode_html,
+    decode_html,
+    load_case,
+)
+from htmltreediff.cli import main
+from htmltreediff.limits import DiffLimits
+
+def capture_files(directory):
+    return sorted(name for name in os.listdir(directory) if name.endswith('.json'))
+
+def test_capture():
+    temp_dir = tempfile.mkdtemp()
+    try:
+        capture = SlowDiffCapture(temp_dir, threshold=0.0)
+        limits = DiffLimits(max_nodes=100, policies={'max_nodes': 'message'})
+        diff('<p>one two</p>', u'<p>one thr\xe9e</p>', cutoff=0.1,
+             limits=limits, capture=capture)
+        [name] = capture_files(temp_dir)
+        case = load_case(os.path.join(temp_dir, name))
+        assert_equal(case['old'], '<p>one two</p>')
+        assert_equal(case['new'], u'<p>one thr\xe9e</p>')
+        assert_equal(case['version'], __version__)
+        assert_equal(case['options']['cutoff'], 0.1)
+        assert_equal(case['options']['limits'].max_nodes, 100)
+        assert_equal(case['options']['limits'].policy_for('max_nodes'), 'message')
+        assert 'differ' in [phase[0] for phase in case['stats']['phases']]
+        assert case['stats']['counters']['sequence_matchers'] > 0
+        assert_equal(capture.total_bytes, os.path.getsize(os.path.join(temp_dir, name)))
+
+        # Captures are rate limited, also across the captures to the same
+        # directory, as in the workers of a server.
+        diff('<p>one</p>', '<p>two</p>', capture=capture)
+        diff('<p>one</p>', '<p>two</p>',
+             capture=SlowDiffCapture(temp_dir, threshold=0.0))
+        assert_equal(len(capture_files(temp_dir)), 1)
+
+        # Large documents, fast diffs, and captures over the size cap of the
+        # directory are skipped.
+        for capture in [
+            SlowDiffCapture(temp_dir, threshold=0.0, min_interval=0.0,
+                            max_case_bytes=10),
+            SlowDiffCapture(temp_dir, threshold=60.0, min_interval=0.0),
+            SlowDiffCapture(temp_dir, threshold=0.0, min_interval=0.0,
+                            max_total_bytes=capture.total_bytes),
+        ]:
+            diff('<p>one</p>', '<p>two</p>', capture=capture)
+            assert_equal(len(capture_files(temp_dir)), 1)
+
+        # The size cap counts the files written by other processes too.
+        size = os.path.getsize(os.path.join(temp_dir, name))
+        capture = SlowDiffCapture(temp_dir, threshold=0.0, min_interval=0.0,
+                                  max_total_bytes=2 * size)
+        shutil.copy(
+            os.path.join(temp_dir, name),
+            os.path.join(temp_dir, 'other-process.json'),
+        )
+        diff('<p>one</p>', '<p>two</p>', capture=capture)
+        assert_equal(len(capture_files(temp_dir)), 2)
+    finally:
+        shutil.rmtree(temp_dir)
+
+def test_encode_html():
+    for html in ['<p>one</p>', u'<p>☃</p>', '<p>\xe2\x98\x83</p>', '<p>\xff</p>']:
+        decoded = decode_html(encode_html(html))
+        assert_equal(decoded, html)
+        assert_equal(type(decoded), type(html))
+
+def test_replay():
+    temp_dir = tempfile.mkdtemp()
+    old_stdout = sys.stdout
+    try:
+        enable_capture(temp_dir, threshold=0.0)
+        try:
+            diff('<p>one two three</p>', '<p>one four three</p>')
+        finally:
+            disable_capture()
+        [name] = capture_files(temp_dir)
+        profile_dir = os.path.join(temp_dir, 'profiles')
+
+        sys.stdout = stdout = StringIO()
+        main(argv=('', 'replay', temp_dir, '--repeat', '1', '--profile', profile_dir))
+        output = stdout.getvalue()
+        assert output.startswith(name[:-len('.json')] + ': captured '), output
+        assert os.path.exists(os.path.join(profile_dir, name[:-len('.json')] + '.pstats'))
+    finally:
+        sys.stdout = old_stdout
+        shutil.rmtree(temp_dir)
@@ -1,4 +1,8 @@
+import os
 import sys
+import json
+import shutil
+import pstats
 import tempfile
 from StringIO import StringIO
 from textwrap import dedent
@@ -7,6 +11,12 @@ from nose.tools import assert_equal
 
 from htmltreediff.cli import main
 
+def write_file(path, contents):
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    with open(path, 'w') as f:
+        f.write(contents)
+
 def test_main():
     # Run the command line interface main function.
     f1 = tempfile.NamedTemporaryFile()
@@ -36,3 +46,125 @@ def test_main():
     finally:
         sys.stdout = old_stdout
 
+
+def test_batch():
+    # Diff two directory trees, with JSON lines output.
+    temp_dir = tempfile.mkdtemp()
+    old_stderr = sys.stderr
+    try:
+        old_dir = os.path.join(temp_dir, 'old')
+        new_dir = os.path.join(temp_dir, 'new')
+        write_file(os.path.join(old_dir, 'a.html'), '<h1>one</h1>')
+        write_file(os.path.join(new_dir, 'a.html'), '<h1>one</h1><h2>two</h2>')
+        write_file(os.path.join(old_dir, 'sub', 'b.html'), '<p>same</p>')
+        write_file(os.path.join(new_dir, 'sub', 'b.html'), '<p>same</p>')
+        write_file(os.path.join(old_dir, 'only_old.html'), '<p>old</p>')
+        output_dir = os.path.join(temp_dir, 'out')
+        jsonl_path = os.path.join(temp_dir, 'results.jsonl')
+
+        sys.stderr = StringIO()
+        status = main(argv=(
+            '', 'batch', old_dir, new_dir, '--jobs', '1', '--skip-unchanged',
+            '--no-pretty', '--jsonl', jsonl_path, '--output-dir', output_dir,
+        ))
+        assert_equal(status, 0)
+        with open(jsonl_path) as f:
+            results = [json.loads(line) for line in f]
+        assert_equal(
+            [(r['name'], r['status'], r['diff']) for r in results],
+            [
+                ('a.html', 'changed', '<h1>one</h1><ins><h2>two</h2></ins>'),
+                ('sub/b.html', 'unchanged', None),
+            ],
+        )
+        with open(os.path.join(output_dir, 'a.html')) as f:
+            assert_equal(f.read(), '<h1>one</h1><ins><h2>two</h2></ins>\n')
+        assert not os.path.exists(os.path.join(output_dir, 'sub', 'b.html'))
+
+        # Diff the same files from a manifest.
+        manifest_path = os.path.join(temp_dir, 'manifest.csv')
+        write_file(manifest_path, 'old,new\nold/a.html,new/a.html\n')
+        sys.stderr = StringIO()
+        status = main(argv=(
+            '', 'batch', '--manifest', manifest_path, '--jobs', '1',
+            '--no-pretty', '--jsonl', jsonl_path,
+        ))
+        assert_equal(status, 0)
+        with open(jsonl_path) as f:
+            results = [json.loads(line) for line in f]
+        assert_equal(
+            [r['diff'] for r in results],
+            ['<h1>one</h1><ins><h2>two</h2></ins>'],
+        )
+
+        # Names that lead outside of the output directory are errors.
+        manifest_path = os.path.join(temp_dir, 'manifest.jsonl')
+        write_file(manifest_path, json.dumps(
+            {'old': 'old/a.html', 'new': 'new/a.html', 'name': '../escaped.html'}))
+        sys.stderr = StringIO()
+        status = main(argv=(
+            '', 'batch', '--manifest', manifest_path, '--jobs', '1',
+            '--jsonl', jsonl_path, '--output-dir', output_dir,
+        ))
+        assert_equal(status, 1)
+        with open(jsonl_path) as f:
+            results = [json.loads(line) for line in f]
+        assert_equal([r['status'] for r in results], ['error'])
+        assert not os.path.exists(os.path.join(temp_dir, 'escaped.html'))
+    finally:
+        sys.stderr = old_stderr
+        shutil.rmtree(temp_dir)
+
+def test_profile():
+    temp_dir = tempfile.mkdtemp()
+    old_stdout = sys.stdout
+    old_stderr = sys.stderr
+    try:
+        old_path = os.path.join(temp_dir, 'old.html')
+        new_path = os.path.join(temp_dir, 'new.html')
+        write_file(old_path, '<p>one two three</p>')
+        write_file(new_path, '<p>one four three</p>')
+        pstats_path = os.path.join(temp_dir, 'diff.pstats')
+        collapsed_path = os.path.join(temp_dir, 'diff.collapsed')
+
+        sys.stdout = StringIO()
+        sys.stderr = stderr = StringIO()
+        main(argv=(
+            '', old_path, new_path, '--repeat', '3',
+            '--profile', pstats_path, '--collapsed', collapsed_path,
+        ))
+        assert stderr.getvalue().startswith('3 runs: min ')
+
+        stats = pstats.Stats(pstats_path)
+        assert any(name == 'diff' for filename, line, name in stats.stats)
+        with open(collapsed_path) as f:
+            lines = f.read().splitlines()
+        assert lines
+        for line in lines:
+            stack, microseconds = line.rsplit(' ', 1)
+            assert stack.startswith('diff (htmltreediff/html.py:'), stack
+            assert int(microseconds) > 0
+    finally:
+        sys.stdout = old_stdout
+        sys.stderr = old_stderr
+        shutil.rmtree(temp_dir)
+
+def test_stats():
+    temp_dir = tempfile.mkdtemp()
+    old_stdout = sys.stdout
+    old_stderr = sys.stderr
+    try:
+        old_path = os.path.join(temp_dir, 'old.html')
+        new_path = os.path.join(temp_dir, 'new.html')
+        write_file(old_path, '<p>one two three</p>')
+        write_file(new_path, '<p>one four three</p>')
+        sys.stdout = StringIO()
+        sys.stderr = stderr = StringIO()
+        main(argv=('', old_path, new_path, '--memory'))
+        report = stderr.getvalue()
+        assert 'differ' in report
+        assert 'peak kb' in report
+    finally:
+        sys.stdout = old_stdout
+        sys.stderr = old_stderr
+        shutil.rmtree(temp_dir)
@@ -0,0 +1,66 @@
+# coding: utf8
+
+import json
+
+from nose.tools import assert_equal, assert_raises
+
+from htmltreediff.util import parse_minidom, minidom_tostring
+from htmltreediff.changes import split_text_nodes
+from htmltreediff.edit_script_runner import EditScriptRunner
+from htmltreediff.edit_script_codec import (
+    encode_edit_script,
+    decode_edit_script,
+    apply_edit_script,
+)
+from htmltreediff.test_util import get_edit_script, parse_cases
+from htmltreediff.tests import all_test_cases
+
+def split_dom(html):
+    dom = parse_minidom(html)
+    split_text_nodes(dom)
+    return dom
+
+def test_edit_script_codec():
+    for case in parse_cases(all_test_cases):
+        def test():
+            edit_script = get_edit_script(case.old_html, case.new_html)
+            data = encode_edit_script(edit_script)
+            assert_equal(decode_edit_script(data), edit_script)
+            # Applying the encoded script gives the same dom as running it.
+            expected = EditScriptRunner(split_dom(case.old_html), edit_script).run_edit_script()
+            actual = apply_edit_script(split_dom(case.old_html), data)
+            assert_equal(minidom_tostring(actual), minidom_tostring(expected))
+        test.description = 'test_edit_script_codec - %s' % case.name
+        yield test
+
+def test_encoded_size():
+    old_html = ''.join('<p class="para">paragraph %d</p>' % i for i in range(100))
+    new_html = ''.join('<p class="para">paragraph number %d</p>' % i for i in range(100))
+    edit_script = get_edit_script(old_html, new_html)
+    data = encode_edit_script(edit_script)
+    assert len(data) * 5 < len(json.dumps(edit_script))
+
+def test_strings():
+    edit_script = [
+        ('insert', [0], {'node_type': 1, 'node_name': u'p',
+                         'attributes': {u'title': u'☃', u'class': u''}}),
+        ('insert', [0, 0], {'node_type': 3, 'node_value': u'caf\xe9 ☃'}),
+    ]
+    data = encode_edit_script(edit_script)
+    assert_equal(decode_edit_script(data), edit_script)
+    dom = apply_edit_script(parse_minidom(''), data)
+    assert_equal(minidom_tostring(dom), u'<p class="" title="☃">caf\xe9 ☃</p>')
+
+def test_invalid_data():
+    data = encode_edit_script([('delete', [0, 1], {'node_type': 3, 'node_value': u'one'})])
+    for bad_data in [
+        '',
+        'HTDX' + data[4:],
+        data[:4] + '\x02' + data[5:],
+        data[:-1],
+        data + '\x00',
+    ]:
+        assert_raises(ValueError, decode_edit_script, bad_data)
+    # The location must exist in the dom.
+    assert_raises(ValueError, apply_edit_script, parse_minidom('<p>one</p>'), data)
+    assert_raises(ValueError, encode_edit_script, [('move', [0], {})])
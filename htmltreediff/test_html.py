@@ -49,6 +49,24 @@ preprocessing_cases = [
         '<p>xxxyyy</p>',
         '<body><p>xxxyyy</p></body>',
     ),
+    (
+        'unwrap span and font tags, and join the text',
+        '<p>one <span>two</span> <font>three</font></p>',
+        '<p>one two three</p>',
+        '<body><p>one two three</p></body>',
+    ),
+    (
+        'ignore the head',
+        '<html><head><title>title</title></head><body><p>one</p></body></html>',
+        '<p>one</p>',
+        '<body><p>one</p></body>',
+    ),
+    (
+        'content after the end of the html',
+        '<html><body><p>one</p></body></html><p>two</p>',
+        '<p>one</p><p>two</p>',
+        '<body><p>one</p><p>two</p></body>',
+    ),
 #TODO failing
 #    (
 #        'illegal text nodes inside tables',
@@ -138,6 +156,16 @@ def test_cutoff():
         '<h2>The differences from the previous version are too large to show '
         'concisely.</h2>',
     )
+    # Similar documents pass the similarity check.
+    changes = diff(
+        '<h1>one two three</h1>',
+        '<h1>one two four</h1>',
+        cutoff=0.2,
+    )
+    assert_html_equal(
+        changes,
+        '<h1>one two <del>three</del><ins>four</ins></h1>',
+    )
 
 def test_html_diff_pretty():
     cases = [
@@ -381,6 +409,19 @@ def test_fix_tables():
             </table>
             ''',
         ),
+        (
+            'remove ins and del tags made by distributing a cell insertion',
+            '''
+            <table>
+              <tr><ins><td>A</td><table></table></ins></tr>
+            </table>
+            ''',
+            '''
+            <table>
+              <tr><td><ins>A</ins></td><table></table></tr>
+            </table>
+            ''',
+        ),
     ]
     for test_name, changes, fixed_changes in cases:
         changes = collapse(changes)
@@ -0,0 +1,57 @@
+from nose.tools import assert_equal, assert_raises
+
+from htmltreediff.html import diff, too_large_message
+from htmltreediff.limits import DiffLimits, DiffTooLarge
+from htmltreediff.stats import DiffStats
+
+def test_limits():
+    old_html = '<div><p>one</p></div>'
+    new_html = '<div><p>one</p><p>two <em>three</em></p></div>'
+    for limit, maximum, value in [
+        ('max_nodes', 7, 8),
+        ('max_depth', 4, 5),
+        ('max_siblings', 1, 2),
+        ('max_tokens', 3, 4),
+    ]:
+        # At the limit, the diff works normally.
+        limits = DiffLimits(**{limit: value})
+        assert_equal(
+            diff(old_html, new_html, limits=limits),
+            '<div><p>one</p><ins><p>two <em>three</em></p></ins></div>',
+        )
+        # Over the limit, it raises an error.
+        limits = DiffLimits(**{limit: maximum})
+        with assert_raises(DiffTooLarge) as context:
+            diff(old_html, new_html, limits=limits)
+        assert_equal(context.exception.limit, limit)
+        assert_equal(context.exception.value, value)
+        assert_equal(context.exception.maximum, maximum)
+
+def test_policies():
+    old_html = '<div><p>one</p></div>'
+    new_html = '<div><p>one</p><p>two</p></div>'
+    limits = DiffLimits(max_depth=2, policy='message')
+    assert_equal(diff(old_html, new_html, limits=limits), too_large_message)
+    limits = DiffLimits(max_depth=2, policy='plaintext')
+    assert_equal(diff(old_html, new_html, limits=limits), 'one<ins> two</ins>')
+    # Plaintext diffs can't fall back to plaintext.
+    limits = DiffLimits(max_tokens=1, policy='plaintext')
+    assert_equal(diff('one', 'one two', plaintext=True, limits=limits), too_large_message)
+    # Neither can diffs that have too much text.
+    assert_equal(diff(old_html, new_html, limits=limits), too_large_message)
+    limits = DiffLimits(max_depth=3, max_siblings=1, policy='raise',
+                        policies={'max_depth': 'message'})
+    assert_equal(diff(old_html, new_html, limits=limits), too_large_message)
+    with assert_raises(DiffTooLarge):
+        diff('<p>one</p>', '<p>one</p><p>two</p>', limits=limits)
+    with assert_raises(ValueError):
+        DiffLimits(policy='ignore')
+
+def test_token_limit():
+    # Splitting the text stops as soon as there are too many words.
+    stats = DiffStats()
+    text = ' '.join(['word'] * 10000)
+    limits = DiffLimits(max_tokens=100, policy='message')
+    assert_equal(diff(text, text, plaintext=True, limits=limits, stats=stats),
+                 too_large_message)
+    assert_equal(stats.sizes['output'], len(too_large_message))
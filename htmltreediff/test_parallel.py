@@ -0,0 +1,66 @@
+import os
+import threading
+
+from nose.tools import assert_equal, assert_raises
+
+from htmltreediff.html import diff
+from htmltreediff.diff_core import DiffCancelled
+from htmltreediff.parallel import DiffPool, WorkerDied, diff_many
+
+pairs = [
+    ('<h1>one</h1>', '<h1>two</h1>'),
+    ('<p>a b c</p>', '<p>a c</p>'),
+    ('<h1>one</h1>', '<h1>one</h1><h2>two</h2>'),
+]
+
+def test_diff_many():
+    expected = [diff(old, new) for old, new in pairs]
+    assert_equal(list(diff_many(pairs, processes=2)), expected)
+    assert_equal(list(diff_many(pairs, threads=True, max_pending=1)), expected)
+
+def test_diff_cancelled():
+    cancel = threading.Event()
+    cancel.set()
+    assert_raises(DiffCancelled, diff, '<h1>one</h1>', '<h1>two</h1>',
+                  cancel=cancel)
+
+def test_task_cancel():
+    with DiffPool(processes=1, threads=True, max_pending=2) as pool:
+        # Occupy the only worker, so that the second task is still queued
+        # when it gets cancelled.
+        start = threading.Event()
+        blocker = pool.submit(_wait_for, start)
+        task = pool.diff_async('<h1>one</h1>', '<h1>two</h1>')
+        task.cancel()
+        start.set()
+        blocker.get()
+        assert_raises(DiffCancelled, task.get)
+
+def test_failed_tasks_release_slots():
+    with DiffPool(processes=1, max_pending=1) as pool:
+        # The function can't be pickled.
+        assert_raises(Exception, pool.submit, lambda cancel: None)
+        # The result can't be pickled.
+        task = pool.submit(_unpicklable_result)
+        assert_raises(Exception, task.get, 10)
+        # The task raises an exception that isn't an Exception.
+        task = pool.submit(_exit)
+        assert_raises(SystemExit, task.get, 10)
+        # The worker process dies.
+        task = pool.submit(_die)
+        assert_raises(WorkerDied, task.get, 10)
+        # The slot is still free for the next task.
+        task = pool.diff_async('<h1>one</h1>', '<h1>two</h1>')
+        assert_equal(task.get(10), diff('<h1>one</h1>', '<h1>two</h1>'))
+
+def _wait_for(event, cancel):
+    event.wait()
+
+def _unpicklable_result(cancel):
+    return lambda: None
+
+def _exit(cancel):
+    raise SystemExit()
+
+def _die(cancel):
+    os._exit(1)
@@ -0,0 +1,107 @@
+import os
+import sys
+import stat
+import shutil
+import tempfile
+import threading
+from StringIO import StringIO
+
+from nose.tools import assert_equal, assert_raises
+
+from htmltreediff.html import diff
+from htmltreediff.cli import main
+from htmltreediff.server import (
+    DiffServer,
+    DiffClient,
+    ServerError,
+    default_socket_path,
+    server_running,
+    try_server_diff,
+)
+
+def test_server():
+    temp_dir = tempfile.mkdtemp()
+    socket_path = os.path.join(temp_dir, 'diff.sock')
+    assert_equal(try_server_diff('a', 'b', socket_path=socket_path), None)
+
+    server = DiffServer(socket_path, workers=1, threads=True)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    try:
+        assert server_running(socket_path)
+        assert_equal(stat.S_IMODE(os.stat(socket_path).st_mode), 0600)
+        client = DiffClient(socket_path)
+        try:
+            assert_equal(
+                client.diff('<h1>one</h1>', '<h1>one</h1><h2>two</h2>'),
+                diff('<h1>one</h1>', '<h1>one</h1><h2>two</h2>'),
+            )
+            assert_equal(
+                client.diff('a b', 'a c', plaintext=True),
+                'a <del>b</del><ins>c</ins>',
+            )
+            assert_raises(ServerError, client.diff, 'a', 'b', bogus=True)
+        finally:
+            client.close()
+
+        # The command line interface forwards diffs to the server.
+        old_path = os.path.join(temp_dir, 'old.html')
+        new_path = os.path.join(temp_dir, 'new.html')
+        with open(old_path, 'w') as f:
+            f.write('<p>one</p>')
+        with open(new_path, 'w') as f:
+            f.write('<p>two</p>')
+        old_stdout = sys.stdout
+        os.environ['HTMLTREEDIFF_SOCKET'] = socket_path
+        try:
+            sys.stdout = stream = StringIO()
+            main(argv=('', old_path, new_path))
+        finally:
+            sys.stdout = old_stdout
+            del os.environ['HTMLTREEDIFF_SOCKET']
+        assert_equal(
+            stream.getvalue(),
+            diff('<p>one</p>', '<p>two</p>', pretty=True) + '\n',
+        )
+    finally:
+        server.shutdown()
+        thread.join()
+        server.server_close()
+        shutil.rmtree(temp_dir)
+    assert not os.path.exists(socket_path)
+
+def test_socket_of_another_user():
+    temp_dir = tempfile.mkdtemp()
+    socket_path = os.path.join(temp_dir, 'diff.sock')
+    server = DiffServer(socket_path, workers=1, threads=True)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    getuid = os.getuid
+    os.getuid = lambda: getuid() + 1
+    try:
+        # The documents aren't sent to a socket that belongs to someone else.
+        assert_equal(try_server_diff('a', 'b', socket_path=socket_path), None)
+        assert_raises(ServerError, DiffClient, socket_path)
+    finally:
+        os.getuid = getuid
+        server.shutdown()
+        thread.join()
+        server.server_close()
+        shutil.rmtree(temp_dir)
+
+def test_default_socket_path():
+    environ = dict(os.environ)
+    try:
+        os.environ.pop('HTMLTREEDIFF_SOCKET', None)
+        os.environ['XDG_RUNTIME_DIR'] = '/run/user/1000'
+        assert_equal(default_socket_path(), '/run/user/1000/htmltreediff.sock')
+        del os.environ['XDG_RUNTIME_DIR']
+        assert_equal(
+            default_socket_path(),
+            os.path.join(tempfile.gettempdir(), 'htmltreediff-%d' % os.getuid(), 'diff.sock'),
+        )
+        os.environ['HTMLTREEDIFF_SOCKET'] = '/somewhere/diff.sock'
+        assert_equal(default_socket_path(), '/somewhere/diff.sock')
+    finally:
+        os.environ.clear()
+        os.environ.update(environ)
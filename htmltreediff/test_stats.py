@@ -0,0 +1,52 @@
+from nose.tools import assert_equal
+
+from htmltreediff.html import diff
+from htmltreediff.stats import DiffStats
+
+def test_stats_callback():
+    calls = []
+    def callback(name, wall, cpu):
+        assert wall >= 0
+        calls.append(name)
+    stats = DiffStats(callback=callback)
+    changes = diff('one two', 'one three', plaintext=True, stats=stats)
+    assert_equal(changes, 'one <del>two</del><ins>three</ins>')
+    assert_equal(calls, [name for name, wall, cpu in stats.phases])
+    assert 'fix_lists' not in calls
+    assert_equal(stats.sizes['output'], len(changes))
+    assert 'differ' in stats.report()
+
+def test_stats_too_different():
+    stats = DiffStats()
+    diff('<h1>totally</h1>', '<h2>different</h2>', cutoff=0.2, stats=stats)
+    assert_equal(
+        [name for name, wall, cpu in stats.phases],
+        ['parse', 'split_text_nodes', 'similarity'],
+    )
+
+def test_counters():
+    old_html = ''.join('<p>paragraph %d</p>' % i for i in range(20))
+    new_html = old_html.replace('paragraph 5', 'paragraph five')
+    stats = DiffStats()
+    diff(old_html, new_html, stats=stats)
+    assert_equal(stats.counters['insert_ops'], 1)
+    assert_equal(stats.counters['delete_ops'], 1)
+    assert_equal(stats.counters['diff_location_calls'], 2)
+    assert_equal(stats.counters['fuzzy_matches'], 1)
+    assert 0 < stats.comparisons_per_node() < 1
+    # The counts are deterministic.
+    other_stats = DiffStats()
+    diff(old_html, new_html, stats=other_stats)
+    assert_equal(stats.counters, other_stats.counters)
+
+def test_memory():
+    stats = DiffStats(memory=True)
+    diff('<p>one two</p>', '<p>one three</p>', stats=stats)
+    assert_equal(
+        [name for name, current, peak in stats.memory],
+        [name for name, wall, cpu in stats.phases],
+    )
+    for name, current, peak in stats.memory:
+        assert current is None or peak >= current
+    assert 'peak kb' in stats.report()
+    assert_equal(stats.as_dict()['memory'], [list(memory) for memory in stats.memory])
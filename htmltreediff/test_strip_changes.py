@@ -0,0 +1,68 @@
+from nose.tools import assert_equal, assert_raises
+
+from htmltreediff.html import diff
+from htmltreediff.strip_changes import strip_changes, iter_strip_changes
+from htmltreediff.test_util import (
+    parse_cases,
+    strip_changes_old,
+    strip_changes_new,
+)
+from htmltreediff.tests import assert_html_equal, test_cases
+
+def test_strip_changes():
+    for case in parse_cases(test_cases):
+        def test():
+            changes = case.target_changes
+            assert_html_equal(strip_changes(changes, 'old'), strip_changes_old(changes))
+            assert_html_equal(strip_changes(changes, 'new'), strip_changes_new(changes))
+        test.description = 'test_strip_changes - %s' % case.name
+        yield test
+
+def test_strip_changes_lists():
+    old_html = '<ol><li>one</li><li>two</li><li>three</li></ol>'
+    new_html = '<ol><li>one</li><li>three</li></ol>'
+    changes = diff(old_html, new_html)
+    assert 'del-li' in changes
+    assert_html_equal(strip_changes(changes, 'old'), old_html)
+    assert_html_equal(strip_changes(changes, 'new'), new_html)
+
+def test_strip_changes_tags():
+    cases = [
+        ('<p><ins/>one<del/></p>', '<p>one</p>', '<p>one</p>'),
+        ('<ins><br>one<br/></ins>', '', '<br>one<br/>'),
+        ('<del><ins>one</ins> <del>two</del></del>', ' two', ''),
+        ('<!-- <ins> --><del>one</del>', '<!-- <ins> -->one', '<!-- <ins> -->'),
+        ('one < two<del>three</del>', 'one < twothree', 'one < two'),
+        ('<li class=\'del-li\' id="x"><del>one</del></li>', '<li id="x">one</li>', ''),
+        ('<li class="del-lite">one</li>', '<li class="del-lite">one</li>',
+         '<li class="del-lite">one</li>'),
+    ]
+    for changes, old_html, new_html in cases:
+        assert_equal(strip_changes(changes, 'old'), old_html)
+        assert_equal(strip_changes(changes, 'new'), new_html)
+
+def test_iter_strip_changes_chunks():
+    changes = ('<p title="a > b">one <del>two<!-- a > b --></del>'
+               '<ins class="x">three</ins> < four</p>')
+    for version in ['old', 'new']:
+        expected = strip_changes(changes, version)
+        for size in range(1, len(changes)):
+            chunks = [changes[i:i + size] for i in range(0, len(changes), size)]
+            assert_equal(''.join(iter_strip_changes(chunks, version)), expected)
+
+def test_iter_strip_changes_long_tokens():
+    # A comment or tag that spans many chunks isn't read again from its
+    # start for each new chunk, which took quadratic time.
+    count = 20000
+    chunks = (['<p>one<!--'] + ['x > y -- z '] * count +
+              ['--><del>two</del><b title="'] + ['x > y '] * count +
+              ['">three</b></p>'])
+    comment = '<!--' + 'x > y -- z ' * count + '-->'
+    tag = '<b title="' + 'x > y ' * count + '">'
+    assert_equal(''.join(iter_strip_changes(chunks, 'new')),
+                 '<p>one' + comment + tag + 'three</b></p>')
+    assert_equal(''.join(iter_strip_changes(chunks, 'old')),
+                 '<p>one' + comment + 'two' + tag + 'three</b></p>')
+
+def test_unknown_version():
+    assert_raises(ValueError, strip_changes, '<p>one</p>', 'newest')
@@ -12,7 +12,18 @@ from htmltreediff.util import (
     minidom_tostring,
     html_equal,
     is_text,
+    walk_dom,
+    copy_dom,
 )
+from htmltreediff.diff_core import Differ, node_properties, iter_edit_script
+from htmltreediff.changes import (
+    sort_del_before_ins,
+    sort_nodes,
+    split_text_nodes,
+    add_changes_markup,
+)
+from htmltreediff.edit_script_runner import EditScriptRunner
+from htmltreediff.adversarial import deep_dom
 from htmltreediff.test_util import (
     reverse_edit_script,
     reverse_changes_html,
@@ -818,6 +829,26 @@ def test_remove_attributes():
     for html, stripped_html, in remove_attributes_cases:
         assert_html_equal(remove_attributes(html), stripped_html)
 
+def recursive_walk(node, elements_only=False):
+    if elements_only and node.nodeType != Node.ELEMENT_NODE:
+        return
+    yield node
+    for child in node.childNodes:
+        for descendant in recursive_walk(child, elements_only):
+            yield descendant
+
+def test_walk_dom():
+    dom = parse_minidom(
+        '<h1>one</h1><ul><li>two <em>three</em></li><li>four</li></ul>five')
+    for elements_only in [False, True]:
+        expected = list(recursive_walk(dom.documentElement, elements_only))
+        assert_equal(list(walk_dom(dom, elements_only)), expected)
+        assert_equal(walk_dom(dom, elements_only, snapshot=True), expected)
+    # Documents deeper than the recursion limit can be walked.
+    dom = deep_dom(5000)
+    assert_equal(len(list(walk_dom(dom))), 5002)
+    assert_equal(len(walk_dom(dom, elements_only=True, snapshot=True)), 5001)
+
 def test_edit_script():
     # edit script output does not reverse easily, don't test the reverse cases
     for case in parse_cases(test_cases + one_way_test_cases):
@@ -834,6 +865,18 @@ def test_edit_script():
         test.description = 'test_edit_script - %s' % case.name
         yield test
 
+def test_deep_edit_script():
+    # Documents deeper than the recursion limit can be diffed.
+    depth = 400
+    old_dom = deep_dom(depth, text='one two')
+    new_dom = deep_dom(depth, text='one three')
+    edit_script = Differ(old_dom, new_dom).get_edit_script()
+    assert_equal(
+        [(action, len(location)) for action, location, properties in edit_script],
+        [('delete', depth + 1), ('insert', depth + 1)],
+    )
+    assert_equal(copy_dom(new_dom).documentElement.toxml(), new_dom.documentElement.toxml())
+
 def test_html_patch():
     for case in parse_cases(all_test_cases):
         # check that applying the diff gives back the same new_html
@@ -848,6 +891,98 @@ def test_html_patch():
         test.description = 'test_html_patch - %s' % case.name
         yield test
 
+def test_differ_nodes():
+    # Without an edit script, the differ still keeps the nodes it inserted and
+    # deleted, in the order of the edit script.
+    for case in parse_cases(all_test_cases):
+        def test():
+            old_dom = parse_minidom(case.old_html)
+            new_dom = parse_minidom(case.new_html)
+            split_text_nodes(old_dom)
+            split_text_nodes(new_dom)
+            edit_script = Differ(old_dom, new_dom).get_edit_script()
+            differ = Differ(old_dom, new_dom, copy=False, edit_script=False)
+            dom = differ.run()
+            assert differ.edit_script is None
+            assert dom is old_dom
+            for action, nodes in [('delete', differ.del_nodes),
+                                  ('insert', differ.ins_nodes)]:
+                assert_equal(
+                    [properties for a, location, properties in edit_script if a == action],
+                    [node_properties(node) for node in nodes],
+                )
+            assert_html_equal(
+                remove_attributes(minidom_tostring(dom)),
+                remove_attributes(case.new_html),
+            )
+        test.description = 'test_differ_nodes - %s' % case.name
+        yield test
+
+def test_range_edit_script():
+    # Range operations give the same changes as operations on single nodes.
+    for case in parse_cases(all_test_cases):
+        def test():
+            changes = []
+            for ranges in [False, True]:
+                old_dom = parse_minidom(case.old_html)
+                new_dom = parse_minidom(case.new_html)
+                split_text_nodes(old_dom)
+                split_text_nodes(new_dom)
+                edit_script = Differ(old_dom, new_dom, ranges=ranges).get_edit_script()
+                runner = EditScriptRunner(old_dom, edit_script)
+                dom = runner.run_edit_script()
+                add_changes_markup(dom, runner.ins_nodes, runner.del_nodes)
+                changes.append(minidom_tostring(dom))
+            assert_html_equal(changes[1], changes[0])
+        test.description = 'test_range_edit_script - %s' % case.name
+        yield test
+
+def test_range_operations():
+    old_dom = parse_minidom('<h1>one</h1><p>two</p><p>three</p>')
+    new_dom = parse_minidom('<h1>one</h1><h2>four <em>five</em></h2>')
+    assert_equal(Differ(old_dom, new_dom, ranges=True).get_edit_script(), [
+        ('delete_range', [1], {'count': 2}),
+        ('insert_subtree', [1], {
+            'node_type': Node.ELEMENT_NODE, 'node_name': u'h2', 'children': [
+                {'node_type': Node.TEXT_NODE, 'node_value': u'four '},
+                {'node_type': Node.ELEMENT_NODE, 'node_name': u'em', 'children': [
+                    {'node_type': Node.TEXT_NODE, 'node_value': u'five'},
+                ]},
+            ],
+        }),
+    ])
+
+def test_iter_edit_script():
+    for case in parse_cases(test_cases + one_way_test_cases):
+        def test():
+            for ranges in [False, True]:
+                old_dom = parse_minidom(case.old_html)
+                new_dom = parse_minidom(case.new_html)
+                split_text_nodes(old_dom)
+                split_text_nodes(new_dom)
+                assert_equal(
+                    list(iter_edit_script(old_dom, new_dom, ranges=ranges)),
+                    Differ(old_dom, new_dom, ranges=ranges).get_edit_script(),
+                )
+        test.description = 'test_iter_edit_script - %s' % case.name
+        yield test
+
+def test_iter_edit_script_is_lazy():
+    old_html = ''.join('<p>one two three %d</p>' % i for i in range(20))
+    new_html = old_html.replace('three', 'four')
+    old_dom = parse_minidom(old_html)
+    new_dom = parse_minidom(new_html)
+    split_text_nodes(old_dom)
+    split_text_nodes(new_dom)
+    differ = Differ(old_dom, new_dom)
+    operations = differ.iter_edit_script()
+    assert_equal(operations.next(), ('delete', [0, 4], {
+        'node_type': Node.TEXT_NODE, 'node_value': u'three'}))
+    # The later paragraphs haven't been diffed yet.
+    last_paragraph = differ.old_dom.documentElement.lastChild
+    assert_equal(last_paragraph.childNodes[4].nodeValue, u'three')
+    assert_equal(len(list(operations)), 39)
+
 def test_cases_sanity():
     # check that removing the ins and del markup gives the original
     sane_cases = (test_cases + reverse_test_cases + one_way_test_cases)
@@ -864,3 +999,31 @@ def test_html_diff():
             assert_html_equal(changes, case.target_changes)
         test.description = 'test_html_diff - %s' % case.name
         yield test
+
+def test_sort_nodes_cmp_func():
+    # The cmp function is passed positionally, as before key was added. Text
+    # nodes are compared too, but only elements move.
+    def node_cmp(a, b):
+        if a.nodeType == a.TEXT_NODE:
+            return 1 if a.data == 'late' else 0
+        return cmp(a.tagName, b.tagName) if b.tagName != 'em' else 0
+    dom = parse_minidom('<i>1</i><b>2</b>late<a>3</a><em>4</em><b>5</b>')
+    sort_nodes(dom, node_cmp)
+    assert_html_equal(
+        minidom_tostring(dom),
+        '<a>3</a><b>2</b><b>5</b><i>1</i><em>4</em>late',
+    )
+
+def test_sort_del_before_ins():
+    # A long run of alternating ins and del tags is sorted in one pass.
+    count = 2000
+    dom = parse_minidom(
+        ''.join('<ins>%d</ins><del>%d</del>' % (i, i) for i in range(count)) +
+        ' <ins>tail</ins><del>tail</del>')
+    sort_del_before_ins(dom)
+    assert_html_equal(
+        minidom_tostring(dom),
+        ''.join('<del>%d</del>' % i for i in range(count)) +
+        ''.join('<ins>%d</ins>' % i for i in range(count)) +
+        ' <del>tail</del><ins>tail</ins>',
+    )
@@ -9,19 +9,19 @@ def full_split(text, regex):
     >>> list(full_split('word', re.compile('&.*?')))
     ['word']
     """
-    while text:
-        m = regex.search(text)
+    # Search from a position instead of slicing off the rest of the text,
+    # which would copy it for every match.
+    pos = 0
+    while pos < len(text):
+        m = regex.search(text, pos)
         if not m:
-            yield text
+            yield text[pos:]
             break
-        left = text[:m.start()]
-        middle = text[m.start():m.end()]
-        right = text[m.end():]
-        if left:
-            yield left
-        if middle:
-            yield middle
-        text = right
+        if m.start() > pos:
+            yield text[pos:m.start()]
+        if m.end() > m.start():
+            yield text[m.start():m.end()]
+        pos = m.end()
 
 def multi_split(text, regexes):
     """
@@ -137,6 +137,42 @@ class WordMatcher(SequenceMatcher):
             self._text_length(self.a) + self._text_length(self.b),
         )
 
+    def quick_text_ratio(self):
+        """Return an upper bound on text_ratio() relatively quickly.
+
+        Only words that occur in both sequences can match, so the bound is
+        based on the shared words, without finding the matching blocks.
+
+        >>> m = WordMatcher(a=['abcdef', '12', '12'], b=['12', 'abcdef', '34'])
+        >>> '%.3f' % m.quick_text_ratio()
+        '0.800'
+        >>> '%.3f' % m.text_ratio()
+        '0.600'
+        """
+        counts = {}
+        for word in self.b:
+            counts[word] = counts.get(word, 0) + 1
+        length = 0
+        for word in self.a:
+            if counts.get(word, 0) > 0:
+                counts[word] -= 1
+                length += self._word_length(word)
+        return _calculate_ratio(
+            length,
+            self._text_length(self.a) + self._text_length(self.b),
+        )
+
+    def real_quick_text_ratio(self):
+        """Return an upper bound on text_ratio() very quickly.
+
+        >>> m = WordMatcher(a=['abcdef', '12'], b=['abcdef'])
+        >>> '%.3f' % m.real_quick_text_ratio()
+        '0.857'
+        """
+        a_length = self._text_length(self.a)
+        b_length = self._text_length(self.b)
+        return _calculate_ratio(min(a_length, b_length), a_length + b_length)
+
     def match_length(self):
         """ Find the total length of all words that match between the two sequences."""
         length = 0
@@ -1,16 +1,21 @@
 import re
 from textwrap import dedent
-import html5lib
-from html5lib import treebuilders
 from xml.dom import minidom, Node
 
 from htmltreediff.text import WordMatcher, split_text
+from htmltreediff.stats import active_stats
 
 ## DOM utilities ##
 # parsing and cleaning #
-from xml.dom.pulldom import SAX2DOM
-import lxml.html, lxml.etree, lxml.sax
-def parse_lxml_dom(xml, strict_xml=True):
+def parse_lxml_dom(xml, strict_xml=True, clean=False):
+    """
+    Parse the xml into a minidom document. The document is cleaned up by
+    DomCleaner as it is built, see there for what clean does.
+    """
+    # The parser modules are slow to import, so they are only imported once
+    # they are needed. Comparing or diffing documents doesn't always parse.
+    from xml.dom.pulldom import SAX2DOM
+    import lxml.html, lxml.etree, lxml.sax
     if strict_xml:
         parse_func = lxml.etree.fromstring
     else:
@@ -21,9 +26,123 @@ def parse_lxml_dom(xml, strict_xml=True):
         tree = parse_func('<body>%s</body>' % xml)
 
     handler = SAX2DOM()
-    lxml.sax.saxify(tree, handler)
+    cleaner = DomCleaner(handler, clean=clean,
+                         remove_whitespace=clean and not strict_xml)
+    lxml.sax.saxify(tree, cleaner)
     return handler.document
 
+class DomCleaner(object):
+    """
+    Pass the SAX events for a document on to the handler that builds the dom,
+    leaving out the parts of the document that aren't diffed:
+        * head elements and their contents are dropped, and html elements
+          are replaced by their contents, so that the body element is the
+          top of the dom. Anything after the end of the body, like lxml puts
+          in a second html element for content after the html end tag, goes
+          at the end of the body.
+        * if clean is True, style elements are dropped, and span and font
+          elements replaced by their contents,
+        * if remove_whitespace is True, text is left out of the elements that
+          can't have text, and runs of whitespace are collapsed to a single
+          space elsewhere, like remove_insignificant_text_nodes() does,
+        * adjacent text is joined, like dom.normalize() does.
+    This way, the dom is built once, already clean, instead of walking it
+    again to clean it up.
+    """
+    def __init__(self, handler, clean=True, remove_whitespace=True):
+        self.handler = handler
+        self.drop_tags = set(['head'])
+        self.unwrap_tags = set(['html'])
+        if clean:
+            self.drop_tags.add('style')
+            self.unwrap_tags.update(['span', 'font'])
+        self.remove_whitespace = remove_whitespace
+        # The tag names of the open elements, as they are in the document.
+        self.tag_names = []
+        # The number of open elements inside a dropped element, or 0.
+        self.drop_depth = 0
+        # The number of open elements that were passed on to the handler.
+        self.depth = 0
+        # The end of the top element, which is held back until the end of
+        # the document.
+        self.top_end = None
+        self.text = []
+
+    def flush_text(self):
+        if self.text:
+            self.handler.characters(''.join(self.text))
+            self.text = []
+
+    def startDocument(self):
+        self.handler.startDocument()
+
+    def endDocument(self):
+        # If every element was left out, the handler never made a document.
+        if self.top_end is not None:
+            self.flush_text()
+            self.handler.endElementNS(*self.top_end)
+            self.handler.endDocument()
+
+    def startPrefixMapping(self, prefix, uri):
+        if not self.drop_depth:
+            self.handler.startPrefixMapping(prefix, uri)
+
+    def endPrefixMapping(self, prefix):
+        if not self.drop_depth:
+            self.handler.endPrefixMapping(prefix)
+
+    def startElementNS(self, name, tag_name, attributes):
+        if self.drop_depth:
+            self.drop_depth += 1
+            return
+        # The text around head and html elements isn't joined, like
+        # parse_minidom() used to remove them after normalizing the dom.
+        if tag_name in _document_tags:
+            self.flush_text()
+        if tag_name in self.drop_tags:
+            self.drop_depth = 1
+            return
+        self.tag_names.append(tag_name)
+        if tag_name not in self.unwrap_tags:
+            self.flush_text()
+            self.handler.startElementNS(name, tag_name, attributes)
+            self.depth += 1
+
+    def endElementNS(self, name, tag_name):
+        if self.drop_depth:
+            self.drop_depth -= 1
+            if not self.drop_depth and tag_name in _document_tags:
+                self.flush_text()
+            return
+        self.tag_names.pop()
+        if tag_name in self.unwrap_tags:
+            if tag_name in _document_tags:
+                self.flush_text()
+            return
+        self.flush_text()
+        self.depth -= 1
+        if self.depth == 0 and self.top_end is None:
+            self.top_end = (name, tag_name)
+            self.depth = 1
+        else:
+            self.handler.endElementNS(name, tag_name)
+
+    def characters(self, text):
+        if self.drop_depth:
+            return
+        if self.remove_whitespace:
+            if self.tag_names and self.tag_names[-1] in _non_text_node_tags:
+                return
+            text = _whitespace_re.sub(' ', text)
+        self.text.append(text)
+
+    def processingInstruction(self, target, data):
+        if not self.drop_depth:
+            self.flush_text()
+            self.handler.processingInstruction(target, data)
+
+_document_tags = set(['head', 'html'])
+
 def parse_text(text):
     dom = parse_lxml_dom('<body/>', strict_xml=True)
 
@@ -32,7 +151,6 @@ def parse_text(text):
     return dom
 
 def parse_minidom(xml, clean=True, strict_xml=False):
-    html_parser = html5lib.HTMLParser(tree=treebuilders.getTreeBuilder('dom'))
     # Preprocessing
     xml = remove_comments(xml)
     if clean and not strict_xml:
@@ -40,30 +158,9 @@ def parse_minidom(xml, clean=True, strict_xml=False):
         xml = normalize_entities(xml)
     xml = xml.strip()
 
-    # Parse
-    dom = parse_lxml_dom(xml, strict_xml=strict_xml)
-
-    if clean:
-        if not strict_xml:
-            remove_insignificant_text_nodes(dom)
-        # clean up irrelevant content
-        for node in list(walk_dom(dom)):
-            if node.nodeType == Node.COMMENT_NODE:
-                remove_node(node) #TODO: line not covered
-            elif node.nodeName == 'style':
-                remove_node(node)
-            elif node.nodeName == 'font':
-                unwrap(node) #TODO: line not covered
-            elif node.nodeName == 'span':
-                unwrap(node)
-    dom.normalize()
-
-    # Make sure that the body element is the top of the dom.
-    for head_element in dom.getElementsByTagName('head'):
-        remove_node(head_element)
-    for html_element in dom.getElementsByTagName('html'):
-        unwrap(html_element)
-    if not dom.documentElement:
+    # Parse, and clean up the dom as it is built.
+    dom = parse_lxml_dom(xml, strict_xml=strict_xml, clean=clean)
+    if dom is None or not dom.documentElement:
         dom = parse_lxml_dom('', strict_xml=True)
 
     if not strict_xml:
@@ -84,8 +181,15 @@ def remove_comments(xml):
     >>> remove_comments('<p>stuff<!-- \\n -->stuff</p>')
     '<p>stuffstuff</p>'
     """
-    regex = re.compile(r'<!--.*?-->', re.DOTALL)
-    return regex.sub('', xml)
+    if '<!--' not in xml:
+        return xml
+    return _comment_re.sub('', xml)
+
+_comment_re = re.compile(r'<!--.*?-->', re.DOTALL)
+# A newline that doesn't separate text. The pattern starts with the newline
+# instead of the lookbehind, so that the regex engine can skip ahead to each
+# newline, instead of trying the lookbehind at every character.
+_insignificant_newline_re = re.compile(r'\n(?<=[>\s]\n)(?=[<\s])')
 
 def remove_newlines(xml):
     r"""Remove newlines in the xml.
@@ -100,12 +204,14 @@ def remove_newlines(xml):
     'one 1'
     >>> remove_newlines('hey!\nmore text!')
     'hey! more text!'
+    >>> remove_newlines('<p>one</p>\r\n\r\n<p>two\r\n\r\nthree</p>')
+    '<p>one</p><p>two  three</p>'
     """
     # Normalize newlines.
     xml = xml.replace('\r\n', '\n')
     xml = xml.replace('\r', '\n')
     # Remove newlines that don't separate text. The remaining ones do separate text.
-    xml = re.sub(r'(?<=[>\s])\n(?=[<\s])', '', xml)
+    xml = _insignificant_newline_re.sub('', xml)
     xml = xml.replace('\n', ' ')
     return xml.strip()
 
@@ -146,27 +252,57 @@ class HashableNode(object):
         return not self.__eq__(other)
 
     def __hash__(self):
+        # The hash of None is based on its memory address, which changes from
+        # process to process. Hash it like an empty string instead, so that
+        # the matching, and the work it does, are the same on every run.
         attributes = frozenset(attribute_dict(self.node).items())
         return hash((self.node.nodeType,
                      self.node.nodeName,
-                     self.node.nodeValue,
+                     self.node.nodeValue or '',
                      attributes))
 
 class HashableTree(object):
     def __init__(self, node):
         self.node = node
 
+    # Both methods go through the trees with an explicit stack, so that they
+    # work on trees deeper than the recursion limit.
+
     def __eq__(self, other):
         if not hasattr(other, 'node'):
             return False
 
-        return (HashableNode(self.node) == HashableNode(other.node) and
-                [HashableTree(c) for c in self.node.childNodes] ==
-                [HashableTree(c) for c in other.node.childNodes])
+        stats = active_stats()
+        stack = [(self.node, other.node)]
+        while stack:
+            a, b = stack.pop()
+            stats.count('compared_nodes')
+            if HashableNode(a) != HashableNode(b):
+                return False
+            if len(a.childNodes) != len(b.childNodes):
+                return False
+            stack.extend(zip(a.childNodes, b.childNodes))
+        return True
 
     def __hash__(self):
-        child_hashes = hash(tuple(HashableTree(c) for c in self.node.childNodes))
-        return hash((HashableNode(self.node), child_hashes))
+        # Hash the children before their parents. The hash of a node combines
+        # the hash of the node itself with the hash of the tuple of its child
+        # hashes.
+        stats = active_stats()
+        child_hashes = [[]]
+        stack = [(self.node, False)]
+        while stack:
+            node, children_hashed = stack.pop()
+            if not children_hashed:
+                stack.append((node, True))
+                child_hashes.append([])
+                for child in reversed(node.childNodes):
+                    stack.append((child, False))
+                continue
+            stats.count('tree_hashes')
+            node_hash = hash((HashableNode(node), hash(tuple(child_hashes.pop()))))
+            child_hashes[-1].append(node_hash)
+        return child_hashes[0][0]
 
 class FuzzyHashableTree(object):
     cutoff = 0.4
@@ -181,12 +317,16 @@ class FuzzyHashableTree(object):
         if HashableNode(self.node) != HashableNode(other.node):
             return False
 
+        stats = active_stats()
+        stats.count('fuzzy_comparisons')
+
         # Check for an exact tree match.
         if HashableTree(self.node) == HashableTree(other.node):
             return True
 
         # Check for a fuzzy match.
         if check_text_similarity(self.node, other.node, cutoff=self.cutoff):
+            stats.count('fuzzy_matches')
             return True
 
         return False
@@ -218,10 +358,11 @@ def remove_xml_declaration(xml):
     return re.sub(r'<\?xml.*\?>', '', xml).strip()
 
 def remove_dom_attributes(dom):
-    for node in walk_dom(dom):
+    for node in walk_dom(dom, snapshot=True):
         for key in attribute_dict(node).keys():
             node.attributes.removeNamedItem(key)
 
+_whitespace_re = re.compile(r'\s+')
 _non_text_node_tags = [
     'html', 'head', 'table', 'thead', 'tbody', 'tfoot', 'tr', 'colgroup',
     'col', 'ul', 'ol', 'dl', 'select', 'img', 'br', 'hr',
@@ -233,13 +374,13 @@ def remove_insignificant_text_nodes(dom):
     single space.
     """
     nodes_to_remove = []
-    for node in walk_dom(dom):
+    for node in walk_dom(dom, snapshot=True):
         if is_text(node):
             text = node.nodeValue
             if node.parentNode.tagName in _non_text_node_tags:
                 nodes_to_remove.append(node)
             else:
-                node.nodeValue = re.sub(r'\s+', ' ', text)
+                node.nodeValue = _whitespace_re.sub(' ', text)
     for node in nodes_to_remove:
         remove_node(node)
 
@@ -277,27 +418,129 @@ def ancestors(node):
         yield ancestor
         ancestor = ancestor.parentNode
 
-def walk_dom(dom, elements_only=False):
+def walk_dom(dom, elements_only=False, snapshot=False):
+    """
+    Iterate over the nodes of the dom in document order, parents before their
+    children. If elements_only is true, skip nodes that aren't elements, and
+    everything below them.
+
+    If snapshot is true, return a list of the nodes instead. This is faster
+    for passes that visit the whole dom, and safe for passes that change it.
+
+    >>> dom = parse_minidom('<h1>one</h1><p>two <em>three</em></p>')
+    >>> [node.nodeName for node in walk_dom(dom)]
+    ['body', 'h1', '#text', 'p', '#text', 'em', '#text']
+    >>> [node.nodeName for node in walk_dom(dom, elements_only=True, snapshot=True)]
+    ['body', 'h1', 'p', 'em']
+    """
     # allow calling this on a document as well as as node
     if hasattr(dom, 'documentElement'):
         dom = dom.documentElement
-    def walk(node):
-        if not node:
-            return #TODO: line not covered
+    if snapshot:
+        return _walk_snapshot(dom, elements_only)
+    return _walk(dom, elements_only)
+
+# Both walks keep their own stack, instead of recursing, so that they work on
+# documents nested deeper than the recursion limit, and so that each node is
+# yielded directly, instead of through one generator per ancestor.
+
+def _walk(node, elements_only):
+    if not node:
+        return #TODO: line not covered
+    if elements_only and not is_element(node):
+        return
+    stats = active_stats()
+    stats.count('walked_nodes')
+    yield node
+    # A stack of iterators over the children of the nodes being walked. They
+    # iterate over the live lists of children, like a for loop would.
+    stack = [iter(node.childNodes)]
+    while stack:
+        for child in stack[-1]:
+            if elements_only and not is_element(child):
+                continue
+            stats.count('walked_nodes')
+            yield child
+            if child.childNodes:
+                stack.append(iter(child.childNodes))
+            break
+        else:
+            stack.pop()
+
+def _walk_snapshot(node, elements_only):
+    nodes = []
+    if not node:
+        return nodes
+    stack = [node]
+    while stack:
+        node = stack.pop()
         if elements_only and not is_element(node):
-            return
-        yield node
-        for child in node.childNodes:
-            for descendant in walk(child):
-                yield descendant
-    return walk(dom)
+            continue
+        nodes.append(node)
+        if node.childNodes:
+            stack.extend(reversed(node.childNodes))
+    active_stats().count('walked_nodes', len(nodes))
+    return nodes
+
+def tag_index(dom, tag_names):
+    """
+    Return a dictionary from each of the tag names to the list of elements
+    with that tag name, in document order. Unlike calling
+    getElementsByTagName for each tag name, this walks the dom only once.
+
+    >>> index = tag_index(parse_minidom('<ul><li>one</li><li>two</li></ul>'), ['li', 'td'])
+    >>> len(index['li']), len(index['td'])
+    (2, 0)
+    """
+    index = dict((tag_name, []) for tag_name in tag_names)
+    for node in walk_dom(dom, elements_only=True):
+        nodes = index.get(node.tagName)
+        if nodes is not None:
+            nodes.append(node)
+    return index
+
+def unique_nodes(nodes):
+    """Return the nodes without duplicates, in the order they first appear."""
+    # Compare by identity, since comparing minidom nodes with == is slow.
+    seen = set()
+    unique = []
+    for node in nodes:
+        if id(node) not in seen:
+            seen.add(id(node))
+            unique.append(node)
+    return unique
 
 def check_text_similarity(a_dom, b_dom, cutoff):
     """Check whether two dom trees have similar text or not."""
-    a_words = list(tree_words(a_dom))
-    b_words = list(tree_words(b_dom))
-
+    if cutoff <= 0.0:
+        return True
+    return check_word_similarity(
+        list(tree_words(a_dom)),
+        list(tree_words(b_dom)),
+        cutoff,
+    )
+
+def check_word_similarity(a_words, b_words, cutoff):
+    """Check whether two lists of words are similar or not.
+
+    The cheap upper bounds on the text ratio are tried first, so that very
+    different texts are rejected without finding the matching blocks.
+
+    >>> check_word_similarity(['one', 'two'], ['three'], cutoff=0.0)
+    True
+    >>> check_word_similarity(['one', 'two'], ['three'], cutoff=0.2)
+    False
+    >>> check_word_similarity(['one', 'two'], ['two', 'one'], cutoff=0.2)
+    True
+    """
+    if cutoff <= 0.0:
+        return True
+    active_stats().count('sequence_matchers')
     sm = WordMatcher(a=a_words, b=b_words)
+    if sm.real_quick_text_ratio() < cutoff:
+        return False
+    if sm.quick_text_ratio() < cutoff:
+        return False
     if sm.text_ratio() >= cutoff:
         return True
     return False
@@ -318,7 +561,7 @@ def tree_text(node):
     'one two three four'
     """
     text = []
-    for descendant in walk_dom(node):
+    for descendant in walk_dom(node, snapshot=True):
         if is_text(descendant):
             text.append(descendant.nodeValue)
     return ' '.join(text)
@@ -326,16 +569,87 @@ def tree_text(node):
 # manipulation #
 def copy_dom(dom):
     new_dom = minidom.Document()
-    doc = new_dom.importNode(dom.documentElement, deep=True)
+    doc = copy_tree(new_dom, dom.documentElement)
     new_dom.documentElement = doc
     return new_dom
 
+def copy_tree(document, node):
+    """
+    Copy the node and all its descendants into the document, like
+    document.importNode(node, deep=True), but without recursion, so that it
+    works on trees deeper than the recursion limit.
+    """
+    root = document.importNode(node, False)
+    stack = [(node, root)]
+    while stack:
+        node, copy = stack.pop()
+        if not node.childNodes:
+            continue
+        children = [document.importNode(child, False) for child in node.childNodes]
+        set_children(copy, children)
+        stack.extend(zip(node.childNodes, children))
+    return root
+
 def remove_node(node):
     """
     Remove the node from the dom. If the node has no parent, raise an error.
     """
     node.parentNode.removeChild(node)
 
+def replace_with_nodes(node, new_nodes):
+    """
+    Replace the node with a list of new nodes, which must not be in the dom.
+    """
+    # This is the same as inserting each new node before the old one, but
+    # minidom's insertBefore searches the whole list of children for each
+    # insert, which makes splitting a large text node quadratic.
+    parent = node.parentNode
+    children = parent.childNodes
+    index = child_index(node)
+    previous = node.previousSibling
+    for new_node in new_nodes:
+        new_node.parentNode = parent
+        new_node.previousSibling = previous
+        if previous is not None:
+            previous.nextSibling = new_node
+        previous = new_node
+    if previous is not None:
+        previous.nextSibling = node.nextSibling
+    if node.nextSibling is not None:
+        node.nextSibling.previousSibling = previous
+    children[index:index + 1] = new_nodes
+    node.parentNode = node.previousSibling = node.nextSibling = None
+
+def set_children(parent, children):
+    """
+    Replace the children of the parent with a list of nodes, which may
+    include its current children.
+    """
+    # Set the links directly, since minidom's appendChild looks through all
+    # the ancestors of the parent for each node it appends.
+    for child in parent.childNodes:
+        child.parentNode = child.previousSibling = child.nextSibling = None
+    previous = None
+    for child in children:
+        if child.parentNode is not None and child.parentNode is not parent:
+            remove_node(child)
+        child.parentNode = parent
+        child.previousSibling = previous
+        if previous is not None:
+            previous.nextSibling = child
+        previous = child
+    if previous is not None:
+        previous.nextSibling = None
+    parent.childNodes[:] = children
+
+def child_index(node):
+    """Return the index of the node among its siblings."""
+    # Compare by identity, since comparing minidom nodes with == is slow.
+    for index, child in enumerate(node.parentNode.childNodes):
+        if child is node:
+            return index
+    raise ValueError('The node is not a child of its parent.')
+
 def insert_or_append(parent, node, next_sibling):
     """
     Insert the node before next_sibling. If next_sibling is None, append the node last instead.
@@ -346,6 +660,68 @@ def insert_or_append(parent, node, next_sibling):
     else:
         parent.appendChild(node)
 
+def insert_children(parent, index, nodes):
+    """
+    Insert the nodes, which must not be in the dom, as children of the parent,
+    starting at the given index.
+    """
+    # Set the links directly, like set_children, since minidom's insertBefore
+    # searches the list of children for the next sibling, for each node.
+    children = parent.childNodes
+    if index > len(children):
+        raise ValueError('Can not insert at index %d of %d children.' % (index, len(children)))
+    if not nodes:
+        return
+    previous = None
+    if index > 0:
+        previous = children[index - 1]
+    next_sibling = None
+    if index < len(children):
+        next_sibling = children[index]
+    for node in nodes:
+        node.parentNode = parent
+        node.previousSibling = previous
+        if previous is not None:
+            previous.nextSibling = node
+        previous = node
+    previous.nextSibling = next_sibling
+    if next_sibling is not None:
+        next_sibling.previousSibling = previous
+    children[index:index] = nodes
+
+def insert_child(parent, index, node):
+    """
+    Insert the node, which must not be in the dom, as the child of the parent
+    at the given index.
+    """
+    insert_children(parent, index, [node])
+
+def remove_children(parent, index, count):
+    """
+    Remove count children of the parent, starting at the given index, and
+    return them.
+    """
+    children = parent.childNodes
+    if index + count > len(children):
+        raise ValueError('Can not remove index %d of %d children.' % (index + count - 1, len(children)))
+    nodes = children[index:index + count]
+    if not nodes:
+        return nodes
+    previous = nodes[0].previousSibling
+    next_sibling = nodes[-1].nextSibling
+    if previous is not None:
+        previous.nextSibling = next_sibling
+    if next_sibling is not None:
+        next_sibling.previousSibling = previous
+    for node in nodes:
+        node.parentNode = node.previousSibling = node.nextSibling = None
+    del children[index:index + count]
+    return nodes
+
+def remove_child(parent, index):
+    """Remove the child of the parent at the given index, and return it."""
+    return remove_children(parent, index, 1)[0]
+
 def wrap(node, tag):
     """Wrap the given tag around a node."""
     wrap_node = node.ownerDocument.createElement(tag)
@@ -362,6 +738,7 @@ def wrap_inner(node, tag):
     for c in children:
         wrap_node.appendChild(c)
     node.appendChild(wrap_node)
+    return wrap_node
 
 def unwrap(node):
     """Remove a node, replacing it with its children."""
@@ -22,9 +22,10 @@ setup(
     platforms=["any"],
     license="BSD",
     packages=find_packages(),
+    package_data={"htmltreediff": ["benchmark_baseline.json"]},
     scripts=[],
     zip_safe=False,
-    install_requires=['lxml', 'html5lib'],
+    install_requires=['lxml'],
     cmdclass={},
     classifiers=[
         "Development Status :: 3 - Alpha",